@@ -4,6 +4,7 @@ Add SYMPTOM_TEXT field to unmapped_symptom_examples.json
 """
 
 import json
+from vaers_subset_io import find_subset_file, iter_subset_records
 
 def add_symptom_text():
     # Read the existing unmapped examples file
@@ -12,13 +13,10 @@ def add_symptom_text():
     
     # Read the VAERS subset to get SYMPTOM_TEXT
     print("Loading VAERS subset data...")
-    with open('json_data/vaers_subset.json', 'r') as f:
-        vaers_data = json.load(f)
-    
     # Create a lookup dictionary by VAERS_ID
     print("Creating VAERS_ID lookup...")
     vaers_lookup = {}
-    for record in vaers_data:
+    for record in iter_subset_records(find_subset_file('json_data')):
         vaers_id = str(record.get('VAERS_ID', ''))
         if vaers_id and 'SYMPTOM_TEXT' in record:
             vaers_lookup[vaers_id] = record['SYMPTOM_TEXT']
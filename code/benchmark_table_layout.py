@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compare the two physical layouts of the analysis database.
+
+Builds the database from json_data twice in a temporary directory, once
+with database_fixed.py's ART indexes ("indexed") and once with the status
+tables sorted by vaccine instead ("clustered"), then times the
+analyze_matches queries and a per-vaccine status query on both. Run from
+the repository root, like database_fixed.py.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+import database_fixed as db
+from vaers_subset_io import find_subset_file
+
+LAYOUTS = ['indexed', 'clustered']
+
+# The kind of query the clustered layout is meant for: one vaccine's rows
+PER_VACCINE_QUERY = """
+    SELECT status, COUNT(*) as symptom_instances, COUNT(DISTINCT VAERS_ID) as reports
+    FROM symptom_status
+    WHERE vaccine = ?
+    GROUP BY status
+"""
+
+def build_database(db_path: str, layout: str):
+    """Load json_data into a new database with the given layout
+
+    Returns the connection and the seconds spent on the layout step
+    (creating the indexes or sorting the tables).
+    """
+    conn = db.setup_database(db_path)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        success = True
+        success &= db.load_fda_reports(conn, "fda_reports.json")
+        success &= db.load_vaers_subset(conn, os.path.basename(find_subset_file("json_data")))
+        success &= db.load_symptom_mappings(conn, "symptom_mappings.json")
+        if success:
+            db.apply_enum_types(conn)
+            db.refresh_symptom_status(conn)
+            started = time.perf_counter()
+            if layout == 'clustered':
+                db.cluster_tables(conn)
+            else:
+                db.create_indexes(conn)
+            layout_seconds = time.perf_counter() - started
+    if not success:
+        print(output.getvalue())
+        raise RuntimeError("Failed to load json_data; run from the repository root")
+    conn.execute("CHECKPOINT")
+    return conn, layout_seconds
+
+def time_query(conn, query: str, params: list, repeat: int):
+    """Median wall time of a query in milliseconds, after one warm-up run"""
+    conn.execute(query, params).fetchall()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        timings.append(1000 * (time.perf_counter() - started))
+    return statistics.median(timings)
+
+def benchmark(repeat: int = 20):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        connections = {}
+        layout_seconds = {}
+        for layout in LAYOUTS:
+            print(f"Building {layout} database...")
+            db_path = os.path.join(tmp_dir, f"{layout}.db")
+            connections[layout], layout_seconds[layout] = build_database(db_path, layout)
+
+        # Parameters for the parameterized queries, taken from the data
+        conn = connections['indexed']
+        example = conn.execute(db.ANALYSIS_QUERIES["high_match_reports"]).fetchone()
+        if example is None:
+            example = conn.execute("SELECT VAERS_ID FROM report_status LIMIT 1").fetchone()
+        top_vaccine = conn.execute("""
+            SELECT vaccine FROM symptom_status GROUP BY vaccine ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+
+        queries = [(name, query, []) for name, query in db.ANALYSIS_QUERIES.items() if '?' not in query]
+        if example:
+            queries.append(("report_details", db.ANALYSIS_QUERIES["report_details"], [example[0]]))
+        if top_vaccine:
+            queries.append(("per_vaccine_status", PER_VACCINE_QUERY, [top_vaccine[0]]))
+
+        print(f"\n{'':22}{'indexed':>14}{'clustered':>14}{'speedup':>10}")
+        print(f"{'layout step (s)':22}{layout_seconds['indexed']:>14.3f}{layout_seconds['clustered']:>14.3f}")
+        for name, query, params in queries:
+            indexed_ms = time_query(connections['indexed'], query, params, repeat)
+            clustered_ms = time_query(connections['clustered'], query, params, repeat)
+            print(f"{name + ' (ms)':22}{indexed_ms:>14.2f}{clustered_ms:>14.2f}{indexed_ms / clustered_ms:>9.2f}x")
+
+        for layout in LAYOUTS:
+            connections[layout].close()
+        sizes = {layout: os.path.getsize(os.path.join(tmp_dir, f"{layout}.db")) / 1024 / 1024 for layout in LAYOUTS}
+        print(f"{'database size (MB)':22}{sizes['indexed']:>14.1f}{sizes['clustered']:>14.1f}")
+        print(f"\nMedian of {repeat} runs per query; speedup > 1 means the clustered layout is faster")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexed vs clustered analysis database layouts")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Timed runs per query (default: 20)')
+    args = parser.parse_args()
+    benchmark(repeat=args.repeat)
+
+if __name__ == "__main__":
+    main()
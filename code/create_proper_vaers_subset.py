@@ -4,10 +4,130 @@ Create proper VAERS subset matching the format of vaers_2024_sample100.json
 Only includes reports for vaccines found in FDA reports
 """
 
+import argparse
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from pathlib import Path
 import os
+import random
+from csv_encoding import detect_encoding
+from vaers_subset_io import (COLUMNAR_FILENAME, SUBSET_BASENAME, write_subset_columnar, write_subset_json,
+                             write_subset_ndjson, write_subset_shards)
+
+# Output database of vaers_parser.py, relative to the repository root
+VAERS_DATABASE = 'intermediate_results/vaers_database.duckdb'
+
+# Which reports go into the subset. A spec file (--spec) overrides any of
+# these keys: vaccine_names keeps reports with at least one of the named
+# vaccines, the RECVDATE range takes YYYY-MM-DD dates and the AGE_YRS range
+# drops reports without an age. All bounds are inclusive; None means no limit.
+DEFAULT_SUBSET_SPEC = {
+    'years': ['2023', '2024'],
+    'vaccine_names': None,
+    'recvdate_from': None,
+    'recvdate_to': None,
+    'age_min': None,
+    'age_max': None,
+}
+
+# Columns each CSV is read with; everything else (HISTORY, LAB_DATA, ...) is skipped
+DATA_COLUMNS = [
+    'VAERS_ID', 'RECVDATE', 'STATE', 'AGE_YRS', 'SEX', 'SYMPTOM_TEXT',
+    'DIED', 'L_THREAT', 'ER_VISIT', 'HOSPITAL', 'DISABLE', 'RECOVD',
+    'VAX_DATE', 'ONSET_DATE', 'NUMDAYS',
+]
+VAX_COLUMNS = ['VAERS_ID', 'VAX_TYPE', 'VAX_MANU', 'VAX_NAME', 'VAX_DOSE_SERIES', 'VAX_ROUTE', 'VAX_SITE']
+SYMPTOM_COLUMNS = ['VAERS_ID'] + [f'SYMPTOM{i}' for i in range(1, 6)]
+CSV_CHUNK_ROWS = 100000
+
+# The subset is capped so the frontend can load it in one request
+MAX_RECORDS = 100000
+SAMPLE_SEED = 42
+
+class RecordReservoir:
+    """Seeded single-pass sample of at most `capacity` records
+
+    Records are offered one at a time with add(), and only the sample is
+    kept, so memory is bounded by the capacity however many records are
+    offered. Without stratification this is plain reservoir sampling: every
+    record is equally likely to be kept.
+
+    With stratify=True records are grouped by the set of vaccines in the
+    report and the capacity is shared out so each group keeps
+    min(group size, level) records, with the level set as high as the
+    capacity allows. Rare vaccines are then kept in full while the common
+    ones are sampled. As more records arrive the level can only drop; each
+    group's reservoir is shrunk by random eviction, which keeps it a uniform
+    sample of that group. The level is a whole number, so a stratified
+    sample can fall slightly short of the capacity.
+
+    The sample is returned in the order the records were offered.
+    """
+
+    def __init__(self, capacity=MAX_RECORDS, seed=SAMPLE_SEED, stratify=False):
+        self.capacity = capacity
+        self.stratify = stratify
+        self.rng = random.Random(seed)
+        self.seen = 0
+        # stratum -> number of records offered / kept (offer index, record) pairs
+        self.stratum_seen = {}
+        self.reservoirs = {}
+        self.stored = 0
+        self.level = capacity
+
+    def _stratum(self, record):
+        if not self.stratify:
+            return None
+        return ' + '.join(sorted(set(record.get('VAX_NAME_list') or [])))
+
+    def _water_level(self):
+        """Largest per-stratum quota whose total fits in the capacity"""
+        counts = sorted(self.stratum_seen.values())
+        remaining = self.capacity
+        for i, count in enumerate(counts):
+            strata_left = len(counts) - i
+            if count * strata_left > remaining:
+                return remaining // strata_left
+            remaining -= count
+        return max(counts)
+
+    def add(self, record):
+        stratum = self._stratum(record)
+        item = (self.seen, record)
+        self.seen += 1
+        seen = self.stratum_seen.get(stratum, 0) + 1
+        self.stratum_seen[stratum] = seen
+        reservoir = self.reservoirs.setdefault(stratum, [])
+
+        if len(reservoir) < self.level and self.stored < self.capacity:
+            reservoir.append(item)
+            self.stored += 1
+            return
+        if len(reservoir) < self.level:
+            # A stratum still under its quota is growing past the capacity,
+            # so the quota of every stratum is lowered to make room
+            reservoir.append(item)
+            self.stored += 1
+            self.level = self._water_level()
+            for other in self.reservoirs.values():
+                while len(other) > self.level:
+                    # Order within a reservoir does not matter, so evict by
+                    # swapping the chosen item to the end
+                    slot = self.rng.randrange(len(other))
+                    other[slot] = other[-1]
+                    other.pop()
+                    self.stored -= 1
+            return
+        # Algorithm R within the stratum
+        slot = self.rng.randrange(seen)
+        if slot < len(reservoir):
+            reservoir[slot] = item
+
+    def records(self):
+        kept = sorted(item for reservoir in self.reservoirs.values() for item in reservoir)
+        return [record for _, record in kept]
 
 def load_fda_vaccine_names():
     """Load the VAERS vaccine names from FDA reports"""
@@ -22,8 +142,331 @@ def load_fda_vaccine_names():
     
     return list(vaers_names)
 
-def create_proper_vaers_subset():
-    """Create VAERS subset with proper format matching sample structure"""
+def load_subset_spec(spec=None):
+    """DEFAULT_SUBSET_SPEC updated with a dict or the path of a JSON spec file"""
+    if isinstance(spec, (str, Path)):
+        with open(spec, 'r') as f:
+            spec = json.load(f)
+    spec = dict(spec or {})
+    unknown = set(spec) - set(DEFAULT_SUBSET_SPEC)
+    if unknown:
+        raise ValueError(f"Unknown subset spec keys: {sorted(unknown)}")
+    return {**DEFAULT_SUBSET_SPEC, **spec, 'years': [str(year) for year in spec.get('years', DEFAULT_SUBSET_SPEC['years'])]}
+
+def read_csv_rows(file_path, columns, keep_rows=None):
+    """Read only the given columns of a VAERS CSV, keeping the rows keep_rows selects
+
+    The file is parsed in chunks and each chunk is filtered straight away,
+    so only the matching rows are ever held. Every column is read as
+    strings so its type does not depend on what a chunk happens to hold;
+    numeric columns are then converted, with unparsable values becoming
+    NaN like TRY_CAST makes them NULL in vaers_parser.py. Rows without a
+    valid VAERS_ID are dropped, as they cannot join to anything.
+    The encoding is detected like vaers_parser.py does, and the file is
+    read again if the sampled encoding turns out to be wrong.
+    """
+    numeric_columns = [column for column in ['VAERS_ID', 'AGE_YRS', 'NUMDAYS'] if column in columns]
+
+    def convert(chunk):
+        for column in numeric_columns:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        return chunk[chunk['VAERS_ID'].notna()].astype({'VAERS_ID': 'int64'})
+
+    def read(encoding):
+        kept = []
+        for chunk in pd.read_csv(file_path, encoding=encoding, usecols=columns, dtype=str,
+                                 on_bad_lines='skip', chunksize=CSV_CHUNK_ROWS):
+            chunk = convert(chunk)
+            kept.append(chunk if keep_rows is None else chunk[keep_rows(chunk)])
+        return pd.concat(kept, ignore_index=True)
+
+    try:
+        return read(detect_encoding(file_path))
+    except UnicodeDecodeError:
+        return read(detect_encoding(file_path, full_scan=True))
+
+def load_year_records_from_csv(year, fda_vaccine_names, spec=None):
+    """Build the subset records of one year from the raw VAERS CSVs"""
+    return load_year_frame_from_csv(year, fda_vaccine_names, spec).to_dict('records')
+
+def load_year_frame_from_csv(year, fda_vaccine_names, spec=None):
+    """Build the subset records of one year as a DataFrame, one row per record
+
+    Phase one reads only VAERS_ID and VAX_NAME to find the qualifying
+    reports; phase two reads the DATA, VAX and SYMPTOMS columns the records
+    need, for those reports only.
+    """
+    spec = load_subset_spec(spec)
+    print(f"\nProcessing {year} VAERS data...")
+    
+    # File paths
+    data_file = f'vaers_data/vaers_data/{year}VAERSDATA.csv'
+    symptoms_file = f'vaers_data/vaers_data/{year}VAERSSYMPTOMS.csv'
+    vax_file = f'vaers_data/vaers_data/{year}VAERSVAX.csv'
+    
+    # Check if files exist
+    if not all(os.path.exists(f) for f in [data_file, symptoms_file, vax_file]):
+        print(f"  Skipping {year} - files not found")
+        return pd.DataFrame()
+        
+    # Phase one: vaccine names only
+    print(f"  Loading VAERS_ID, VAX_NAME from {year}VAERSVAX.csv...")
+    vax_df = read_csv_rows(vax_file, ['VAERS_ID', 'VAX_NAME'])
+    
+    # Filter vaccines for our FDA list
+    vax_filtered = vax_df[vax_df['VAX_NAME'].isin(fda_vaccine_names)]
+    print(f"  Found {len(vax_filtered)} vaccine records matching FDA vaccines")
+    
+    # Get unique VAERS_IDs for reports that ONLY contain FDA vaccines
+    # First, find reports with non-FDA vaccines
+    non_fda_vax = vax_df[~vax_df['VAX_NAME'].isin(fda_vaccine_names)]
+    reports_with_non_fda = set(non_fda_vax['VAERS_ID'].unique())
+    
+    # Get reports that only have FDA vaccines
+    all_reports_with_fda = set(vax_filtered['VAERS_ID'].unique())
+    vaers_ids = all_reports_with_fda - reports_with_non_fda
+    print(f"  Found {len(vaers_ids)} unique VAERS reports with ONLY FDA vaccines")
+    
+    if spec['vaccine_names']:
+        named = set(vax_df.loc[vax_df['VAX_NAME'].isin(spec['vaccine_names']), 'VAERS_ID'])
+        vaers_ids &= named
+        print(f"  {len(vaers_ids)} of them include {', '.join(spec['vaccine_names'])}")
+    
+    # Phase two: only the needed columns of the qualifying reports
+    def keep_data_rows(chunk):
+        keep = chunk['VAERS_ID'].isin(vaers_ids)
+        if spec['recvdate_from'] or spec['recvdate_to']:
+            recvdate = pd.to_datetime(chunk['RECVDATE'], format='%m/%d/%Y', errors='coerce')
+            if spec['recvdate_from']:
+                keep &= recvdate >= pd.Timestamp(spec['recvdate_from'])
+            if spec['recvdate_to']:
+                keep &= recvdate <= pd.Timestamp(spec['recvdate_to'])
+        if spec['age_min'] is not None:
+            keep &= chunk['AGE_YRS'] >= spec['age_min']
+        if spec['age_max'] is not None:
+            keep &= chunk['AGE_YRS'] <= spec['age_max']
+        return keep
+    
+    print(f"  Loading {year}VAERSDATA.csv...")
+    data_filtered = read_csv_rows(data_file, DATA_COLUMNS, keep_data_rows)
+    report_ids = set(data_filtered['VAERS_ID'])
+    
+    def keep_report_rows(chunk):
+        return chunk['VAERS_ID'].isin(report_ids)
+    
+    print(f"  Loading {year}VAERSSYMPTOMS.csv...")
+    symptoms_filtered = read_csv_rows(symptoms_file, SYMPTOM_COLUMNS, keep_report_rows)
+    
+    print(f"  Loading {year}VAERSVAX.csv...")
+    vax_filtered = read_csv_rows(vax_file, VAX_COLUMNS, keep_report_rows)  # Get all vaccines for these reports
+    
+    # Group symptoms by VAERS_ID: one row per (report, symptom), sorted so
+    # each report's list comes out deduplicated and in a stable order
+    symptom_columns = [f'SYMPTOM{i}' for i in range(1, 6)]
+    symptoms_long = (
+        symptoms_filtered.melt(id_vars='VAERS_ID', value_vars=symptom_columns, value_name='symptom')
+        .dropna(subset=['symptom'])
+        .drop_duplicates(subset=['VAERS_ID', 'symptom'])
+        .sort_values(['VAERS_ID', 'symptom'])
+    )
+    symptoms_grouped = symptoms_long.groupby('VAERS_ID')['symptom'].agg(list).rename('symptom_list').reset_index()
+    
+    # Group vaccines by VAERS_ID, keeping file order within each report
+    vax_grouped = pd.DataFrame({'VAERS_ID': vax_filtered['VAERS_ID'].unique()})
+    for column in ['VAX_TYPE', 'VAX_MANU', 'VAX_NAME', 'VAX_DOSE_SERIES', 'VAX_ROUTE', 'VAX_SITE']:
+        values = vax_filtered[['VAERS_ID', column]].dropna()
+        if column == 'VAX_DOSE_SERIES':
+            values[column] = values[column].astype(str)
+        grouped = values.groupby('VAERS_ID', sort=False)[column].agg(list)
+        vax_grouped = vax_grouped.merge(grouped.reset_index(), on='VAERS_ID', how='left')
+    
+    # Merge all data
+    merged = data_filtered.merge(symptoms_grouped, on='VAERS_ID', how='left')
+    merged = merged.merge(vax_grouped, on='VAERS_ID', how='left')
+    # Same record order as the DuckDB path, which has no file order to follow
+    merged = merged.sort_values('VAERS_ID', kind='stable', ignore_index=True)
+    
+    # Define value mappers
+    sex_map = {'M': 'male', 'F': 'female', 'U': 'unknown'}
+    yes_no_unknown_map = {'Y': 'yes', 'N': 'no', 'U': 'unknown'}
+    
+    def nullable(column):
+        # NaN -> None so the JSON gets null
+        return column.astype(object).where(column.notna(), None)
+    
+    def as_list(column):
+        # Reports without vaccine/symptom rows get an empty list
+        return [value if isinstance(value, list) else [] for value in column]
+    
+    # Convert to proper format, one column at a time
+    records = pd.DataFrame({
+        "VAERS_ID": merged['VAERS_ID'].astype('int64'),
+        "RECVDATE": nullable(merged['RECVDATE']),
+        "STATE": nullable(merged['STATE']),
+        "AGE_YRS": nullable(merged['AGE_YRS'].astype(float)),
+        "SEX": nullable(merged['SEX'].map(sex_map)),
+        "SYMPTOM_TEXT": nullable(merged['SYMPTOM_TEXT']),
+        "DIED": merged['DIED'].eq('Y'),  # Boolean
+        "L_THREAT": merged['L_THREAT'].eq('Y'),  # Boolean
+        "ER_VISIT": merged['ER_VISIT'].eq('Y'),  # Boolean
+        "HOSPITAL": merged['HOSPITAL'].eq('Y'),  # Boolean
+        "DISABLE": merged['DISABLE'].eq('Y'),  # Boolean
+        "RECOVD": nullable(merged['RECOVD'].map(yes_no_unknown_map)),  # String: yes/no/unknown
+        "VAX_DATE": nullable(merged['VAX_DATE']),
+        "ONSET_DATE": nullable(merged['ONSET_DATE']),
+        "NUMDAYS": nullable(merged['NUMDAYS'].astype(float)),
+        "VAX_TYPE_list": as_list(merged['VAX_TYPE']),
+        "VAX_MANU_list": as_list(merged['VAX_MANU']),
+        "VAX_NAME_list": as_list(merged['VAX_NAME']),
+        "VAX_DOSE_SERIES_list": as_list(merged['VAX_DOSE_SERIES']),
+        "VAX_ROUTE_list": as_list(merged['VAX_ROUTE']),
+        "VAX_SITE_list": as_list(merged['VAX_SITE']),
+        "symptom_list": as_list(merged['symptom_list'])
+    })
+    
+    return records
+
+def iter_subset_records_from_database(database, fda_vaccine_names, spec=None, batch_size=10000):
+    """Yield the subset records of one query over the vaers_parser.py tables
+
+    Report filtering, list aggregation and value mapping all happen in
+    DuckDB; records come out in the same order as the CSV path (by year,
+    then by VAERS_ID) and are fetched in batches.
+    """
+    import duckdb
+
+    spec = load_subset_spec(spec)
+    years = [int(year) for year in spec['years']]
+    params = {'years': years, 'fda_names': fda_vaccine_names}
+
+    # The rest of the subset spec, applied to the reports and their data rows
+    report_filter = ""
+    if spec['vaccine_names']:
+        report_filter = "AND bool_or(COALESCE(list_contains($vaccine_names, VAX_NAME), false))"
+        params['vaccine_names'] = spec['vaccine_names']
+    data_filters = []
+    for key, condition in [('recvdate_from', "d.RECVDATE >= CAST($recvdate_from AS DATE)"),
+                           ('recvdate_to', "d.RECVDATE <= CAST($recvdate_to AS DATE)"),
+                           ('age_min', "d.AGE_YRS >= $age_min"),
+                           ('age_max', "d.AGE_YRS <= $age_max")]:
+        if spec[key] is not None:
+            data_filters.append(condition)
+            params[key] = spec[key]
+    data_filter = ' '.join(f"AND {condition}" for condition in data_filters)
+
+    print(f"\nQuerying {database} for years {years}...")
+    with duckdb.connect(database, read_only=True) as conn:
+        tables = {row[0] for row in conn.execute("SHOW TABLES").fetchall()}
+        # Databases built with encode_symptoms store symptom ids
+        if 'symptom_dictionary' in tables:
+            symptoms_source = """
+                SELECT s.VAERS_ID, s.year, sd.SYMPTOM
+                FROM symptoms_long s JOIN symptom_dictionary sd ON s.symptom_id = sd.symptom_id
+            """
+        else:
+            symptoms_source = "SELECT VAERS_ID, year, SYMPTOM FROM symptoms_long"
+
+        def vax_list(column):
+            return f"COALESCE(list({column} ORDER BY v.rowid) FILTER (WHERE {column} IS NOT NULL), [])"
+
+        def yes_null_to_bool(column):
+            return f"COALESCE(d.{column} = 'Y', false) AS {column}"
+
+        result = conn.execute(f"""
+            WITH qualifying AS (
+                -- Reports whose vaccines are ALL in the FDA list; a missing
+                -- VAX_NAME counts as a non-FDA vaccine
+                SELECT year, VAERS_ID
+                FROM all_vax
+                WHERE list_contains($years, year)
+                GROUP BY year, VAERS_ID
+                HAVING bool_and(COALESCE(list_contains($fda_names, VAX_NAME), false))
+                {report_filter}
+            ),
+            vax AS (
+                SELECT v.year, v.VAERS_ID,
+                       {vax_list('v.VAX_TYPE')} AS VAX_TYPE_list,
+                       {vax_list('v.VAX_MANU')} AS VAX_MANU_list,
+                       {vax_list('v.VAX_NAME')} AS VAX_NAME_list,
+                       {vax_list('CAST(v.VAX_DOSE_SERIES AS VARCHAR)')} AS VAX_DOSE_SERIES_list,
+                       {vax_list('v.VAX_ROUTE')} AS VAX_ROUTE_list,
+                       {vax_list('v.VAX_SITE')} AS VAX_SITE_list
+                FROM all_vax v
+                SEMI JOIN qualifying q ON v.year = q.year AND v.VAERS_ID = q.VAERS_ID
+                GROUP BY v.year, v.VAERS_ID
+            ),
+            symptoms AS (
+                SELECT s.year, s.VAERS_ID, list(DISTINCT s.SYMPTOM ORDER BY s.SYMPTOM) AS symptom_list
+                FROM ({symptoms_source}) s
+                SEMI JOIN qualifying q ON s.year = q.year AND s.VAERS_ID = q.VAERS_ID
+                GROUP BY s.year, s.VAERS_ID
+            )
+            SELECT
+                d.VAERS_ID,
+                strftime(d.RECVDATE, '%m/%d/%Y') AS RECVDATE,
+                d.STATE,
+                CAST(d.AGE_YRS AS DOUBLE) AS AGE_YRS,
+                CASE d.SEX WHEN 'M' THEN 'male' WHEN 'F' THEN 'female' WHEN 'U' THEN 'unknown' END AS SEX,
+                d.SYMPTOM_TEXT,
+                {yes_null_to_bool('DIED')},
+                {yes_null_to_bool('L_THREAT')},
+                {yes_null_to_bool('ER_VISIT')},
+                {yes_null_to_bool('HOSPITAL')},
+                {yes_null_to_bool('DISABLE')},
+                CASE d.RECOVD WHEN 'Y' THEN 'yes' WHEN 'N' THEN 'no' WHEN 'U' THEN 'unknown' END AS RECOVD,
+                strftime(d.VAX_DATE, '%m/%d/%Y') AS VAX_DATE,
+                strftime(d.ONSET_DATE, '%m/%d/%Y') AS ONSET_DATE,
+                CAST(d.NUMDAYS AS DOUBLE) AS NUMDAYS,
+                COALESCE(v.VAX_TYPE_list, []) AS VAX_TYPE_list,
+                COALESCE(v.VAX_MANU_list, []) AS VAX_MANU_list,
+                COALESCE(v.VAX_NAME_list, []) AS VAX_NAME_list,
+                COALESCE(v.VAX_DOSE_SERIES_list, []) AS VAX_DOSE_SERIES_list,
+                COALESCE(v.VAX_ROUTE_list, []) AS VAX_ROUTE_list,
+                COALESCE(v.VAX_SITE_list, []) AS VAX_SITE_list,
+                COALESCE(s.symptom_list, []) AS symptom_list
+            FROM all_data d
+            SEMI JOIN qualifying q ON d.year = q.year AND d.VAERS_ID = q.VAERS_ID
+            LEFT JOIN vax v ON d.year = v.year AND d.VAERS_ID = v.VAERS_ID
+            LEFT JOIN symptoms s ON d.year = s.year AND d.VAERS_ID = s.VAERS_ID
+            WHERE true {data_filter}
+            ORDER BY list_position($years, d.year), d.VAERS_ID
+        """, params)
+
+        columns = [column[0] for column in result.description]
+        count = 0
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            count += len(rows)
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    print(f"  Found {count} reports with ONLY FDA vaccines")
+
+def create_proper_vaers_subset(source='csv', database=VAERS_DATABASE, output_format='json', compress=False,
+                               max_records=MAX_RECORDS, seed=SAMPLE_SEED, stratify=False, shards=False,
+                               parallel=False, max_workers=None, spec=None):
+    """Create VAERS subset with proper format matching sample structure
+
+    source='csv' reads the raw VAERS CSVs with pandas; source='duckdb' builds
+    the same records from the tables vaers_parser.py wrote to database.
+    output_format is 'json' (the array the frontend loads), 'ndjson' (one
+    record per line, gzipped with compress=True), 'columnar' (dictionary-
+    encoded struct of arrays), 'both' (json and ndjson) or a list of these.
+    Records beyond max_records are sampled out as they arrive (see
+    RecordReservoir). With shards=True the subset is also split into one
+    file per vaccine, indexed in json_data/manifest.json.
+
+    With parallel=True the CSV path processes years in a process pool of
+    max_workers (default: one per year, up to the CPU count). Results are
+    still consumed in year order, so the output is the same as a sequential
+    run, and at most max_workers years are submitted but not yet consumed.
+
+    spec selects the years and, optionally, vaccine names, RECVDATE and
+    AGE_YRS ranges (see DEFAULT_SUBSET_SPEC); it is a dict or the path of a
+    JSON file.
+    """
     print("Creating proper VAERS subset (100K records) for vaccines in FDA reports...")
     
     # Load FDA vaccine names
@@ -32,148 +475,62 @@ def create_proper_vaers_subset():
     for name in sorted(fda_vaccine_names):
         print(f"  - {name}")
     
-    # Define years to process
-    years = ['2023', '2024']
+    # Define years and reports to process
+    spec = load_subset_spec(spec)
+    years = spec['years']
+    print(f"Subset spec: {spec}")
     
-    all_records = []
+    # Only the sample is kept in memory, whichever source the records come from
+    reservoir = RecordReservoir(max_records, seed=seed, stratify=stratify)
+    if source == 'duckdb':
+        for record in iter_subset_records_from_database(database, fda_vaccine_names, spec):
+            reservoir.add(record)
+    elif parallel and len(years) > 1:
+        max_workers = max_workers or min(len(years), os.cpu_count() or 1)
+        print(f"\nProcessing {len(years)} years with {max_workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Workers send back compact DataFrames; the next year is only
+            # submitted once the oldest pending one has been consumed
+            def consume_oldest():
+                for record in pending.popleft().result().to_dict('records'):
+                    reservoir.add(record)
+
+            pending = deque()
+            for year in years:
+                pending.append(executor.submit(load_year_frame_from_csv, year, fda_vaccine_names, spec))
+                if len(pending) >= max_workers:
+                    consume_oldest()
+            while pending:
+                consume_oldest()
+    else:
+        for year in years:
+            for record in load_year_records_from_csv(year, fda_vaccine_names, spec):
+                reservoir.add(record)
+    all_records = reservoir.records()
     
-    for year in years:
-        print(f"\nProcessing {year} VAERS data...")
-        
-        # File paths
-        data_file = f'vaers_data/vaers_data/{year}VAERSDATA.csv'
-        symptoms_file = f'vaers_data/vaers_data/{year}VAERSSYMPTOMS.csv'
-        vax_file = f'vaers_data/vaers_data/{year}VAERSVAX.csv'
-        
-        # Check if files exist
-        if not all(os.path.exists(f) for f in [data_file, symptoms_file, vax_file]):
-            print(f"  Skipping {year} - files not found")
-            continue
-        
-        # Load data files with error handling
-        print(f"  Loading {year}VAERSDATA.csv...")
-        data_df = pd.read_csv(data_file, encoding='latin-1', low_memory=False, on_bad_lines='skip')
-        
-        print(f"  Loading {year}VAERSSYMPTOMS.csv...")
-        symptoms_df = pd.read_csv(symptoms_file, encoding='latin-1', low_memory=False, on_bad_lines='skip')
-        
-        print(f"  Loading {year}VAERSVAX.csv...")
-        vax_df = pd.read_csv(vax_file, encoding='latin-1', low_memory=False, on_bad_lines='skip')
-        
-        # Filter vaccines for our FDA list
-        vax_filtered = vax_df[vax_df['VAX_NAME'].isin(fda_vaccine_names)]
-        print(f"  Found {len(vax_filtered)} vaccine records matching FDA vaccines")
-        
-        # Get unique VAERS_IDs for reports that ONLY contain FDA vaccines
-        # First, find reports with non-FDA vaccines
-        non_fda_vax = vax_df[~vax_df['VAX_NAME'].isin(fda_vaccine_names)]
-        reports_with_non_fda = set(non_fda_vax['VAERS_ID'].unique())
-        
-        # Get reports that only have FDA vaccines
-        all_reports_with_fda = set(vax_filtered['VAERS_ID'].unique())
-        vaers_ids = list(all_reports_with_fda - reports_with_non_fda)
-        print(f"  Found {len(vaers_ids)} unique VAERS reports with ONLY FDA vaccines")
-        
-        # Filter other dataframes
-        data_filtered = data_df[data_df['VAERS_ID'].isin(vaers_ids)]
-        symptoms_filtered = symptoms_df[symptoms_df['VAERS_ID'].isin(vaers_ids)]
-        vax_filtered = vax_df[vax_df['VAERS_ID'].isin(vaers_ids)]  # Get all vaccines for these reports
-        
-        # Group symptoms by VAERS_ID
-        symptoms_grouped = symptoms_filtered.groupby('VAERS_ID').agg({
-            'SYMPTOM1': lambda x: list(x.dropna()),
-            'SYMPTOM2': lambda x: list(x.dropna()),
-            'SYMPTOM3': lambda x: list(x.dropna()),
-            'SYMPTOM4': lambda x: list(x.dropna()),
-            'SYMPTOM5': lambda x: list(x.dropna())
-        }).reset_index()
-        
-        # Combine symptom columns into a single list
-        symptoms_grouped['symptom_list'] = symptoms_grouped.apply(
-            lambda row: list(set(row['SYMPTOM1'] + row['SYMPTOM2'] + row['SYMPTOM3'] + 
-                                row['SYMPTOM4'] + row['SYMPTOM5'])), axis=1
-        )
-        
-        # Group vaccines by VAERS_ID
-        vax_grouped = vax_filtered.groupby('VAERS_ID').agg({
-            'VAX_TYPE': lambda x: list(x.dropna()),
-            'VAX_MANU': lambda x: list(x.dropna()),
-            'VAX_NAME': lambda x: list(x.dropna()),
-            'VAX_DOSE_SERIES': lambda x: [str(v) for v in x.dropna()],
-            'VAX_ROUTE': lambda x: list(x.dropna()),
-            'VAX_SITE': lambda x: list(x.dropna())
-        }).reset_index()
-        
-        # Merge all data
-        merged = data_filtered.merge(symptoms_grouped[['VAERS_ID', 'symptom_list']], 
-                                    on='VAERS_ID', how='left')
-        merged = merged.merge(vax_grouped, on='VAERS_ID', how='left')
-        
-        # Define value mappers
-        sex_map = {'M': 'male', 'F': 'female', 'U': 'unknown'}
-        
-        # Convert to proper format
-        for _, row in merged.iterrows():
-            # Helper function to convert Y/null to boolean
-            def map_yes_null_to_bool(value):
-                if pd.isna(value) or value is None:
-                    return False
-                return value == 'Y'
-            
-            # Helper function for Y/N/U fields (keep as strings)
-            def map_yes_no_unknown(value):
-                if pd.isna(value) or value is None:
-                    return None
-                if value == 'Y':
-                    return 'yes'
-                elif value == 'N':
-                    return 'no'
-                elif value == 'U':
-                    return 'unknown'
-                else:
-                    return None
-            
-            record = {
-                "VAERS_ID": int(row['VAERS_ID']) if pd.notna(row['VAERS_ID']) else None,
-                "RECVDATE": row['RECVDATE'] if pd.notna(row['RECVDATE']) else None,
-                "STATE": row['STATE'] if pd.notna(row['STATE']) else None,
-                "AGE_YRS": float(row['AGE_YRS']) if pd.notna(row['AGE_YRS']) else None,
-                "SEX": sex_map.get(row['SEX'], None) if pd.notna(row['SEX']) else None,
-                "SYMPTOM_TEXT": row['SYMPTOM_TEXT'] if pd.notna(row['SYMPTOM_TEXT']) else None,
-                "DIED": map_yes_null_to_bool(row['DIED']),  # Boolean
-                "L_THREAT": map_yes_null_to_bool(row['L_THREAT']),  # Boolean
-                "ER_VISIT": map_yes_null_to_bool(row['ER_VISIT']),  # Boolean
-                "HOSPITAL": map_yes_null_to_bool(row['HOSPITAL']),  # Boolean
-                "DISABLE": map_yes_null_to_bool(row['DISABLE']),  # Boolean
-                "RECOVD": map_yes_no_unknown(row['RECOVD']),  # String: yes/no/unknown
-                "VAX_DATE": row['VAX_DATE'] if pd.notna(row['VAX_DATE']) else None,
-                "ONSET_DATE": row['ONSET_DATE'] if pd.notna(row['ONSET_DATE']) else None,
-                "NUMDAYS": float(row['NUMDAYS']) if pd.notna(row['NUMDAYS']) else None,
-                "VAX_TYPE_list": row['VAX_TYPE'] if isinstance(row['VAX_TYPE'], list) else [],
-                "VAX_MANU_list": row['VAX_MANU'] if isinstance(row['VAX_MANU'], list) else [],
-                "VAX_NAME_list": row['VAX_NAME'] if isinstance(row['VAX_NAME'], list) else [],
-                "VAX_DOSE_SERIES_list": row['VAX_DOSE_SERIES'] if isinstance(row['VAX_DOSE_SERIES'], list) else [],
-                "VAX_ROUTE_list": row['VAX_ROUTE'] if isinstance(row['VAX_ROUTE'], list) else [],
-                "VAX_SITE_list": row['VAX_SITE'] if isinstance(row['VAX_SITE'], list) else [],
-                "symptom_list": row['symptom_list'] if isinstance(row['symptom_list'], list) else []
-            }
-            all_records.append(record)
-    
-    print(f"\nTotal records collected: {len(all_records)}")
-    
-    # Sample to 100K records if we have more
-    if len(all_records) > 100000:
-        import random
-        random.seed(42)  # For reproducibility
-        all_records = random.sample(all_records, 100000)
-        print(f"Sampled down to 100,000 records")
+    print(f"\nTotal records collected: {reservoir.seen}")
+    if reservoir.seen > len(all_records):
+        sampling = "stratified by vaccine" if stratify else "uniformly"
+        print(f"Sampled down to {len(all_records):,} records ({sampling}, seed {seed})")
     
     # Save the results
     Path('json_data').mkdir(parents=True, exist_ok=True)
-    with open('json_data/vaers_subset.json', 'w') as f:
-        json.dump(all_records, f, indent=2)
-    
-    print(f"\n✓ Created vaers_subset.json with {len(all_records)} reports")
+    formats = [output_format] if isinstance(output_format, str) else list(output_format)
+    if 'both' in formats:
+        formats += ['json', 'ndjson']
+    if 'json' in formats:
+        count = write_subset_json(all_records, f'json_data/{SUBSET_BASENAME}.json')
+        print(f"\n✓ Created {SUBSET_BASENAME}.json with {count} reports")
+    if 'ndjson' in formats:
+        filename = f'{SUBSET_BASENAME}.ndjson' + ('.gz' if compress else '')
+        count = write_subset_ndjson(all_records, f'json_data/{filename}')
+        print(f"\n✓ Created {filename} with {count} reports")
+    if 'columnar' in formats:
+        count = write_subset_columnar(all_records, f'json_data/{COLUMNAR_FILENAME}')
+        print(f"\n✓ Created {COLUMNAR_FILENAME} with {count} reports")
+    if shards:
+        index = write_subset_shards(all_records, 'json_data')
+        print(f"\n✓ Created {len(index['shards'])} per-vaccine shards, indexed in json_data/manifest.json")
     
     # Show summary of vaccines in the subset
     vaccine_counts = {}
@@ -186,4 +543,36 @@ def create_proper_vaers_subset():
         print(f"  {vax}: {count:,} reports")
 
 if __name__ == "__main__":
-    create_proper_vaers_subset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duckdb', nargs='?', const=VAERS_DATABASE, metavar='DATABASE',
+                        help=f"build from the vaers_parser.py database (default: {VAERS_DATABASE}) "
+                             "instead of the raw CSVs")
+    parser.add_argument('--format', nargs='+', choices=['json', 'ndjson', 'columnar', 'both'], default=['json'],
+                        help="json: array for the frontend (default); ndjson: one record per line; "
+                             "columnar: dictionary-encoded arrays per field; both: json and ndjson")
+    parser.add_argument('--gzip', action='store_true', help="gzip the NDJSON output")
+    parser.add_argument('--max-records', type=int, default=MAX_RECORDS,
+                        help=f"sample the subset down to this many reports (default: {MAX_RECORDS})")
+    parser.add_argument('--seed', type=int, default=SAMPLE_SEED, help=f"sampling seed (default: {SAMPLE_SEED})")
+    parser.add_argument('--stratify', action='store_true',
+                        help="sample each vaccine (combination) separately so rare vaccines are kept")
+    parser.add_argument('--parallel', action='store_true', help="process years in parallel worker processes")
+    parser.add_argument('--max-workers', type=int, help="number of worker processes for --parallel")
+    parser.add_argument('--spec', metavar='FILE',
+                        help="JSON subset spec with years, vaccine_names, recvdate_from/to, age_min/max")
+    parser.add_argument('--shards', action='store_true',
+                        help="also write one file per vaccine, indexed in json_data/manifest.json")
+    args = parser.parse_args()
+    create_proper_vaers_subset(
+        source='duckdb' if args.duckdb else 'csv',
+        database=args.duckdb or VAERS_DATABASE,
+        output_format=args.format,
+        compress=args.gzip,
+        max_records=args.max_records,
+        seed=args.seed,
+        stratify=args.stratify,
+        shards=args.shards,
+        parallel=args.parallel,
+        max_workers=args.max_workers,
+        spec=args.spec,
+    )
@@ -10,27 +10,25 @@ import requests
 import os
 import time
 from collections import Counter
+from vaers_subset_io import find_subset_file, iter_subset_records
 
 def get_vaers_symptoms():
     """Extract, flatten, and dedupe symptoms from VAERS subset"""
     print("Loading VAERS symptoms...")
     
-    with open('../json_data/vaers_subset.json', 'r') as f:
-        vaers_data = json.load(f)
-    
-    print(f"Loaded {len(vaers_data)} VAERS reports")
-    
-    # Flatten all symptoms from all reports
-    all_symptoms = []
-    for record in vaers_data:
+    # Count symptoms from all reports as they are read
+    symptom_counts = Counter()
+    report_count = 0
+    for record in iter_subset_records(find_subset_file('../json_data')):
+        report_count += 1
         symptom_list = record.get('symptom_list', [])
         if symptom_list:  # Make sure it's not empty
-            all_symptoms.extend(symptom_list)
+            symptom_counts.update(symptom_list)
     
-    print(f"Found {len(all_symptoms)} total symptom occurrences")
+    print(f"Loaded {report_count} VAERS reports")
+    print(f"Found {sum(symptom_counts.values())} total symptom occurrences")
     
     # Count and dedupe
-    symptom_counts = Counter(all_symptoms)
     print(f"Found {len(symptom_counts)} unique VAERS symptoms after deduping")
     
     # Show top symptoms
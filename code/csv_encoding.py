@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Detect the text encoding of VAERS CSV files from a bounded byte sample.
+
+The sample is made of blocks spread over the whole file, since VAERS files
+are mostly ASCII and a single non-utf-8 report can sit anywhere in them.
+A reader that still hits undecodable bytes can ask for a full scan, which
+replaces the cached guess. The result is cached in a sidecar JSON file next to the CSVs, keyed by file
+name, size and mtime, so each file is only sniffed again after it changes.
+CSVs inside a published ZIP archive (given as zipfile.Path) are sampled
+straight from the archive and cached next to it.
+"""
+
+import codecs
+import json
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Union
+
+# How much of each file is inspected, in SAMPLE_BLOCKS blocks from its start
+# to its end
+SAMPLE_BYTES = 4 * 1024 * 1024
+SAMPLE_BLOCKS = 16
+
+# Chunk size of a full scan
+SCAN_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Deleting every other byte leaves only 0x80-0x9F, which are control
+# characters in latin-1 but smart quotes, dashes etc. in cp1252
+_NOT_C1_BYTES = bytes(b for b in range(256) if not 0x80 <= b <= 0x9F)
+
+CACHE_FILENAME = '.encoding_cache.json'
+
+# Parallel loaders share the sidecar file
+_cache_lock = threading.Lock()
+
+
+def sniff_encoding(blocks: Iterable[bytes], contiguous: bool = False) -> str:
+    """Pick utf-8, cp1252 or latin-1 for byte blocks of a file
+
+    Blocks are independent samples unless contiguous is set, in which case
+    they are consecutive chunks and one utf-8 decoder runs across them.
+    """
+    is_utf8, is_cp1252, has_c1 = True, True, False
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    for block in blocks:
+        if is_utf8:
+            if not contiguous:
+                utf8_decoder.reset()
+            try:
+                # Incremental decode so a multi-byte character cut off at the
+                # end of a block is not mistaken for invalid utf-8
+                utf8_decoder.decode(block, final=False)
+            except UnicodeDecodeError:
+                is_utf8 = False
+        if block.translate(None, _NOT_C1_BYTES):
+            has_c1 = True
+            if is_cp1252:
+                try:
+                    block.decode('cp1252')
+                except UnicodeDecodeError:
+                    is_cp1252 = False
+
+    if is_utf8:
+        return 'utf-8'
+    # Windows-exported VAERS text uses the cp1252 characters in 0x80-0x9F
+    if has_c1 and is_cp1252:
+        return 'cp1252'
+    return 'latin-1'
+
+
+def _sample_blocks(f: BinaryIO, size: int, sample_bytes: int) -> List[bytes]:
+    """Read SAMPLE_BLOCKS evenly spaced blocks, the first at the start of
+    the file and the last at its end"""
+    if size <= sample_bytes:
+        return [f.read()]
+    block_bytes = sample_bytes // SAMPLE_BLOCKS
+    blocks = []
+    for i in range(SAMPLE_BLOCKS):
+        offset = i * (size - block_bytes) // (SAMPLE_BLOCKS - 1)
+        f.seek(offset)
+        block = f.read(block_bytes)
+        if offset:
+            # Skip the tail of a utf-8 character cut off at the block start
+            skip = 0
+            while skip < min(3, len(block)) and 0x80 <= block[skip] <= 0xBF:
+                skip += 1
+            block = block[skip:]
+        blocks.append(block)
+    return blocks
+
+
+def source_stat(file_path: Union[Path, zipfile.Path]):
+    """Size and mtime of a CSV on disk or inside a ZIP archive"""
+    if isinstance(file_path, zipfile.Path):
+        info = file_path.root.getinfo(file_path.at)
+        return info.file_size, time.mktime(info.date_time + (0, 0, -1))
+    stat = Path(file_path).stat()
+    return stat.st_size, stat.st_mtime
+
+
+def _cache_location(file_path: Union[Path, zipfile.Path]):
+    """Sidecar cache path and key for a CSV on disk or inside a ZIP archive"""
+    if isinstance(file_path, zipfile.Path):
+        archive_path = Path(file_path.root.filename)
+        return archive_path.parent / CACHE_FILENAME, f"{archive_path.name}/{file_path.at}"
+    return file_path.parent / CACHE_FILENAME, file_path.name
+
+
+def _load_cache(cache_path: Path) -> dict:
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_cache(cache_path: Path, cache: dict) -> None:
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # A read-only data folder just means we sniff again next time
+        print(f"  Could not write encoding cache {cache_path}: {e}")
+
+
+def detect_encoding(file_path: Union[str, Path, zipfile.Path], sample_bytes: int = SAMPLE_BYTES,
+                    full_scan: bool = False) -> str:
+    """Return the encoding of a CSV file, using the sidecar cache when it is current
+
+    With full_scan=True the whole file is read and the result replaces the
+    cached one; readers use this when the sampled encoding fails on the file.
+    """
+    if not isinstance(file_path, zipfile.Path):
+        file_path = Path(file_path)
+    size, mtime = source_stat(file_path)
+    cache_path, cache_key = _cache_location(file_path)
+
+    if not full_scan:
+        with _cache_lock:
+            entry = _load_cache(cache_path).get(cache_key)
+        if entry and entry.get('size') == size and entry.get('mtime') == mtime:
+            return entry['encoding']
+
+    with file_path.open('rb') as f:
+        if full_scan:
+            encoding = sniff_encoding(iter(lambda: f.read(SCAN_CHUNK_BYTES), b''), contiguous=True)
+        else:
+            encoding = sniff_encoding(_sample_blocks(f, size, sample_bytes))
+
+    with _cache_lock:
+        cache = _load_cache(cache_path)
+        cache[cache_key] = {
+            'size': size,
+            'mtime': mtime,
+            'encoding': encoding,
+        }
+        _save_cache(cache_path, cache)
+
+    return encoding
@@ -1,9 +1,81 @@
+import argparse
 import duckdb
+import hashlib
 import json
 from pathlib import Path
 import os
 import sys
 import pandas as pd
+from vaers_subset_io import find_subset_file, iter_subset_records
+
+# Records which source file each table was last loaded from, so unchanged
+# sources can be skipped on the next run
+LOAD_METADATA_TABLE = "load_metadata"
+
+# Column definitions of the loaded tables; staging tables are created from
+# the same definitions, and changing one forces that table to be reloaded
+TABLE_SCHEMAS = {
+    "fda_reports": """
+            vaccine_name VARCHAR,  -- The VAERS-compatible name
+            vax_name VARCHAR,      -- Original FDA name
+            vax_manu VARCHAR,
+            adverse_event VARCHAR
+    """,
+    # One row per report; vaers_subset_exploded unnests the lists into
+    # one row per vaccine-symptom combination for queries that need it
+    "vaers_subset": """
+            VAERS_ID VARCHAR,
+            AGE_YRS DOUBLE,
+            SEX VARCHAR,
+            vax_names VARCHAR[],  -- Distinct VAX_NAME_list entries
+            symptoms VARCHAR[]    -- Distinct symptom_list entries
+    """,
+    "symptom_mappings": """
+            vaers_symptom VARCHAR,
+            fda_adverse_event VARCHAR
+    """,
+}
+
+# ENUM types derived from the loaded data, each shared by the columns that
+# are joined or grouped together, so joins and GROUP BYs compare small
+# integers instead of strings
+ENUM_COLUMNS = {
+    "vaccine_name_enum": [("fda_reports", "vaccine_name"), ("vaers_subset", "vax_names")],
+    "fda_vax_name_enum": [("fda_reports", "vax_name")],
+    "vax_manu_enum": [("fda_reports", "vax_manu")],
+    "symptom_enum": [("vaers_subset", "symptoms"), ("symptom_mappings", "vaers_symptom")],
+    "fda_event_enum": [("fda_reports", "adverse_event"), ("symptom_mappings", "fda_adverse_event")],
+}
+
+# Columns of the tables refresh_symptom_status derives from the ones above.
+# They use the same ENUMs, so the status refresh and the analysis join and
+# group on them without comparing strings, but add no values of their own:
+# when the types are recreated these tables are emptied, and the next
+# refresh rebuilds them in full.
+DERIVED_ENUM_COLUMNS = {
+    "vaccine_name_enum": [("symptom_status", "vaccine"), ("report_status", "vaccine"),
+                          ("status_vaccine_events", "vaccine_name")],
+    "symptom_enum": [("symptom_status", "vaers_symptom")],
+    "fda_event_enum": [("symptom_status", "mapped_fda_symptoms"), ("symptom_status", "fda_documented_symptoms"),
+                       ("status_vaccine_events", "adverse_events")],
+}
+
+# ART indexes of the "indexed" layout
+INDEXES = {
+    "idx_fda_vax": ("fda_reports", "vaccine_name"),
+    "idx_symptom_map": ("symptom_mappings", "vaers_symptom"),
+}
+
+# Sort order of each table in the "clustered" layout; leading with the
+# vaccine keeps each vaccine's rows together, so zone maps let per-vaccine
+# queries skip the other row groups. Only the status tables are sorted:
+# vaers_subset's vaccines and symptoms are lists, reached through UNNEST or
+# list_contains, which zone maps cannot prune, and fda_reports and
+# symptom_mappings fit in a single row group.
+CLUSTER_KEYS = {
+    "symptom_status": ["vaccine", "vaers_symptom"],
+    "report_status": ["vaccine", "VAERS_ID"],
+}
 
 # ============= SETUP FUNCTIONS =============
 
@@ -15,36 +87,144 @@ def setup_database(db_path: str = "duckdb/vaers_analysis.db"):
     conn = duckdb.connect(db_path)
     
     # Create tables with proper schema
+    for table, schema in TABLE_SCHEMAS.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({schema})")
+    
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LOAD_METADATA_TABLE} (
+            table_name VARCHAR PRIMARY KEY,
+            source_file VARCHAR,
+            content_hash VARCHAR,   -- sha256 of the source file
+            schema_hash VARCHAR,    -- sha256 of the table's column definitions
+            source_bytes BIGINT,
+            source_records BIGINT,  -- Top-level records in the source file
+            row_count BIGINT,       -- Rows loaded into the table
+            loaded_at TIMESTAMP
+        )
+    """)
+    
+    # Symptom status materialized from the three tables by refresh_symptom_status
     conn.execute("""
-        CREATE TABLE IF NOT EXISTS fda_reports (
-            vaccine_name VARCHAR,  -- The VAERS-compatible name
-            vax_name VARCHAR,      -- Original FDA name
-            vax_manu VARCHAR,
-            adverse_event VARCHAR
+        CREATE TABLE IF NOT EXISTS symptom_status (
+            VAERS_ID VARCHAR,
+            vaccine VARCHAR,
+            vaers_symptom VARCHAR,
+            mapped_fda_symptoms VARCHAR[],      -- NULL if the symptom is not mapped
+            fda_documented_symptoms VARCHAR[],  -- Mapped terms in the vaccine's FDA list
+            status VARCHAR                      -- FDA Documented / Mapped but not in FDA / Not mapped
         )
     """)
     
     conn.execute("""
-        CREATE TABLE IF NOT EXISTS vaers_subset (
+        CREATE TABLE IF NOT EXISTS report_status (
             VAERS_ID VARCHAR,
-            AGE_YRS DOUBLE,
-            SEX VARCHAR,
-            vax_name VARCHAR,
-            symptom VARCHAR
+            vaccine VARCHAR,
+            total_symptoms BIGINT,
+            fda_documented BIGINT,
+            mapped_not_fda BIGINT,
+            not_mapped BIGINT,
+            match_rate DOUBLE      -- Percent of symptoms that are FDA documented
         )
     """)
     
+    # FDA adverse events per vaccine as of the last refresh, to find the
+    # vaccines whose status rows are out of date
     conn.execute("""
-        CREATE TABLE IF NOT EXISTS symptom_mappings (
-            vaers_symptom VARCHAR,
-            fda_adverse_event VARCHAR
+        CREATE TABLE IF NOT EXISTS status_vaccine_events (
+            vaccine_name VARCHAR,
+            adverse_events VARCHAR[]
         )
     """)
     
     return conn
 
-def load_fda_reports(conn: duckdb.DuckDBPyConnection, filepath: str):
-    """Load FDA reports data."""
+def file_sha256(path: str, chunk_size: int = 1024 * 1024):
+    """Hex sha256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def schema_sha256(table: str):
+    return hashlib.sha256(TABLE_SCHEMAS[table].encode('utf-8')).hexdigest()
+
+def source_unchanged(conn: duckdb.DuckDBPyConnection, table: str, full_path: str, content_hash: str):
+    """True if table was last loaded from this exact file content and schema
+
+    The table's current row count must also match the recorded one, so a
+    table that was modified by hand is reloaded.
+    """
+    loaded = conn.execute(f"""
+        SELECT source_file, content_hash, schema_hash, row_count
+        FROM {LOAD_METADATA_TABLE}
+        WHERE table_name = ?
+    """, [table]).fetchone()
+    if loaded is None:
+        return False
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return loaded == (os.path.basename(full_path), content_hash, schema_sha256(table), row_count)
+
+def create_staging_table(conn: duckdb.DuckDBPyConnection, table: str):
+    """Create an empty staging table for a rebuild of table and return its name"""
+    staging = f"{table}_staging"
+    conn.execute(f"CREATE OR REPLACE TABLE {staging} ({TABLE_SCHEMAS[table]})")
+    return staging
+
+def swap_in_staging(conn: duckdb.DuckDBPyConnection, table: str, full_path: str,
+                    content_hash: str, source_records: int):
+    """Replace table with its fully loaded staging table and record the load
+
+    The swap and the metadata update happen in one transaction, so readers
+    see either the old table or the complete new one. Returns the row count.
+    """
+    staging = f"{table}_staging"
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {staging}").fetchone()[0]
+    conn.begin()
+    try:
+        # Indexes go with the old table; main() recreates them
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {LOAD_METADATA_TABLE}
+            VALUES (?, ?, ?, ?, ?, ?, ?, now())
+        """, [table, os.path.basename(full_path), content_hash, schema_sha256(table),
+              os.path.getsize(full_path), source_records, row_count])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return row_count
+
+def create_exploded_view(conn: duckdb.DuckDBPyConnection):
+    """Create vaers_subset_exploded, one row per report, vaccine and symptom"""
+    conn.execute("""
+        CREATE OR REPLACE VIEW vaers_subset_exploded AS
+        SELECT v.VAERS_ID, v.AGE_YRS, v.SEX, vax.vax_name, sym.symptom
+        FROM vaers_subset v,
+            UNNEST(v.vax_names) AS vax(vax_name),
+            UNNEST(v.symptoms) AS sym(symptom)
+    """)
+
+def drop_staging_table(conn: duckdb.DuckDBPyConnection, table: str):
+    """Discard a partially loaded staging table, leaving table untouched"""
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {table}_staging")
+    except Exception as e:
+        print(f"Could not drop {table}_staging: {e}")
+
+def insert_columns(conn: duckdb.DuckDBPyConnection, table: str, columns: dict):
+    """Insert a batch given as {column: list of values} with a single statement"""
+    batch = pd.DataFrame(columns)
+    conn.register('insert_batch', batch)
+    try:
+        conn.execute(f"INSERT INTO {table} BY NAME SELECT * FROM insert_batch")
+    finally:
+        conn.unregister('insert_batch')
+    return len(batch)
+
+def load_fda_reports(conn: duckdb.DuckDBPyConnection, filepath: str, force: bool = False):
+    """Load FDA reports data, unless the file is unchanged since the last load."""
     print("Loading FDA reports...")
     
     full_path = os.path.join("json_data", filepath)
@@ -54,24 +234,32 @@ def load_fda_reports(conn: duckdb.DuckDBPyConnection, filepath: str):
         return False
     
     try:
+        content_hash = file_sha256(full_path)
+        if not force and source_unchanged(conn, 'fda_reports', full_path, content_hash):
+            print(f"{filepath} unchanged since last load, keeping fda_reports")
+            return True
+        
         # Load JSON
         with open(full_path, 'r') as f:
             data = json.load(f)
         
-        # Clear existing data
-        conn.execute("DELETE FROM fda_reports")
+        # Build the new table next to the current one
+        staging = create_staging_table(conn, 'fda_reports')
         
-        # Insert data
+        # Collect one row per adverse event, then insert them in one go
+        rows = {'vaccine_name': [], 'vax_name': [], 'vax_manu': [], 'adverse_event': []}
         for report in data:
             vaccine_name = report.get('vaccine_name', '')  # VAERS-compatible name
             vax_name = report.get('vax_name', '')  # Original FDA name
             vax_manu = report.get('vax_manu', '')
             
             for ae in report.get('adverse_events', []):
-                conn.execute("""
-                    INSERT INTO fda_reports (vaccine_name, vax_name, vax_manu, adverse_event)
-                    VALUES (?, ?, ?, ?)
-                """, [vaccine_name, vax_name, vax_manu, ae])
+                rows['vaccine_name'].append(vaccine_name)
+                rows['vax_name'].append(vax_name)
+                rows['vax_manu'].append(vax_manu)
+                rows['adverse_event'].append(ae)
+        insert_columns(conn, staging, rows)
+        swap_in_staging(conn, 'fda_reports', full_path, content_hash, len(data))
         
         count = conn.execute("SELECT COUNT(DISTINCT vaccine_name) FROM fda_reports").fetchone()[0]
         print(f"Loaded {count} vaccines from FDA reports")
@@ -91,10 +279,18 @@ def load_fda_reports(conn: duckdb.DuckDBPyConnection, filepath: str):
         
     except Exception as e:
         print(f"Error loading FDA reports: {e}")
+        drop_staging_table(conn, 'fda_reports')
         return False
 
-def load_vaers_subset(conn: duckdb.DuckDBPyConnection, filepath: str):
-    """Load VAERS subset data."""
+def load_vaers_subset(conn: duckdb.DuckDBPyConnection, filepath: str, batch_size: int = 10000,
+                      force: bool = False):
+    """Load VAERS subset data, unless the file is unchanged since the last load.
+
+    Each report becomes one row holding its distinct vaccine names and
+    symptoms as lists, so a report with several vaccines is not repeated
+    once per vaccine. The subset is parsed incrementally and every batch_size reports are
+    inserted together, so memory use does not grow with the subset.
+    """
     print("\nLoading VAERS subset...")
     
     full_path = os.path.join("json_data", filepath)
@@ -104,42 +300,59 @@ def load_vaers_subset(conn: duckdb.DuckDBPyConnection, filepath: str):
         return False
     
     try:
-        # Load JSON - this might be large, so we'll process in chunks
-        with open(full_path, 'r') as f:
-            data = json.load(f)
+        content_hash = file_sha256(full_path)
+        if not force and source_unchanged(conn, 'vaers_subset', full_path, content_hash):
+            print(f"{filepath} unchanged since last load, keeping vaers_subset")
+            return True
         
-        # Clear existing data
-        conn.execute("DELETE FROM vaers_subset")
+        # Build the new table next to the current one
+        staging = create_staging_table(conn, 'vaers_subset')
         
-        # Process records
-        insert_count = 0
-        for record in data:
+        # Process records one at a time; rows are collected column-wise and
+        # each batch is inserted with one statement
+        def empty_batch():
+            return {'VAERS_ID': [], 'AGE_YRS': [], 'SEX': [], 'vax_names': [], 'symptoms': []}
+        
+        rows = empty_batch()
+        batch_reports = 0
+        record_count = 0
+        for record in iter_subset_records(full_path):
             vaers_id = record.get('VAERS_ID')
+            vaers_id = None if vaers_id is None else str(vaers_id)
             age = record.get('AGE_YRS')
             sex = record.get('SEX')
-            vax_names = record.get('VAX_NAME_list', [])
-            symptoms = record.get('symptom_list', [])
+            # A vaccine listed for several doses only counts once
+            vax_names = list(dict.fromkeys(record.get('VAX_NAME_list') or []))
+            symptoms = list(dict.fromkeys(record.get('symptom_list') or []))
+            
+            rows['VAERS_ID'].append(vaers_id)
+            rows['AGE_YRS'].append(age)
+            rows['SEX'].append(sex)
+            rows['vax_names'].append(vax_names)
+            rows['symptoms'].append(symptoms)
             
-            # Create a record for each vaccine-symptom combination
-            for vax in vax_names:
-                for symptom in symptoms:
-                    conn.execute("""
-                        INSERT INTO vaers_subset (VAERS_ID, AGE_YRS, SEX, vax_name, symptom)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, [vaers_id, age, sex, vax, symptom])
-                    insert_count += 1
+            record_count += 1
+            batch_reports += 1
+            if batch_reports == batch_size:
+                insert_columns(conn, staging, rows)
+                rows = empty_batch()
+                batch_reports = 0
+        insert_columns(conn, staging, rows)
+        swap_in_staging(conn, 'vaers_subset', full_path, content_hash, record_count)
+        create_exploded_view(conn)
         
         report_count = conn.execute("SELECT COUNT(DISTINCT VAERS_ID) FROM vaers_subset").fetchone()[0]
-        vaccine_count = conn.execute("SELECT COUNT(DISTINCT vax_name) FROM vaers_subset").fetchone()[0]
+        vaccine_count = conn.execute("SELECT COUNT(DISTINCT vax_name) FROM (SELECT UNNEST(vax_names) AS vax_name FROM vaers_subset)").fetchone()[0]
+        pair_count = conn.execute("SELECT SUM(len(vax_names) * len(symptoms)) FROM vaers_subset").fetchone()[0] or 0
         
         print(f"Loaded {report_count} VAERS reports with {vaccine_count} unique vaccines")
-        print(f"Total vaccine-symptom records: {insert_count}")
+        print(f"Total vaccine-symptom combinations: {pair_count}")
         
         # Show sample
         print("\nTop VAERS vaccines by report count:")
         samples = conn.execute("""
             SELECT vax_name, COUNT(DISTINCT VAERS_ID) as report_count
-            FROM vaers_subset
+            FROM (SELECT VAERS_ID, UNNEST(vax_names) AS vax_name FROM vaers_subset)
             GROUP BY vax_name
             ORDER BY report_count DESC
             LIMIT 5
@@ -150,10 +363,11 @@ def load_vaers_subset(conn: duckdb.DuckDBPyConnection, filepath: str):
         
     except Exception as e:
         print(f"Error loading VAERS subset: {e}")
+        drop_staging_table(conn, 'vaers_subset')
         return False
 
-def load_symptom_mappings(conn: duckdb.DuckDBPyConnection, filepath: str):
-    """Load symptom mappings data."""
+def load_symptom_mappings(conn: duckdb.DuckDBPyConnection, filepath: str, force: bool = False):
+    """Load symptom mappings data, unless the file is unchanged since the last load."""
     print("\nLoading symptom mappings...")
     
     full_path = os.path.join("json_data", filepath)
@@ -163,23 +377,29 @@ def load_symptom_mappings(conn: duckdb.DuckDBPyConnection, filepath: str):
         return False
     
     try:
+        content_hash = file_sha256(full_path)
+        if not force and source_unchanged(conn, 'symptom_mappings', full_path, content_hash):
+            print(f"{filepath} unchanged since last load, keeping symptom_mappings")
+            return True
+        
         # Load JSON
         with open(full_path, 'r') as f:
             data = json.load(f)
         
-        # Clear existing data
-        conn.execute("DELETE FROM symptom_mappings")
+        # Build the new table next to the current one
+        staging = create_staging_table(conn, 'symptom_mappings')
         
-        # Insert data
+        # Collect one row per mapped FDA event, then insert them in one go
+        rows = {'vaers_symptom': [], 'fda_adverse_event': []}
         for mapping in data:
             vaers_symptom = mapping.get('vaers_symptom', '')
             fda_events = mapping.get('fda_adverse_events', [])
             
             for fda_event in fda_events:
-                conn.execute("""
-                    INSERT INTO symptom_mappings (vaers_symptom, fda_adverse_event)
-                    VALUES (?, ?)
-                """, [vaers_symptom, fda_event])
+                rows['vaers_symptom'].append(vaers_symptom)
+                rows['fda_adverse_event'].append(fda_event)
+        insert_columns(conn, staging, rows)
+        swap_in_staging(conn, 'symptom_mappings', full_path, content_hash, len(data))
         
         count = conn.execute("SELECT COUNT(DISTINCT vaers_symptom) FROM symptom_mappings").fetchone()[0]
         print(f"Loaded {count} symptom mappings")
@@ -188,18 +408,309 @@ def load_symptom_mappings(conn: duckdb.DuckDBPyConnection, filepath: str):
         
     except Exception as e:
         print(f"Error loading symptom mappings: {e}")
+        drop_staging_table(conn, 'symptom_mappings')
         return False
 
-def analyze_matches(conn: duckdb.DuckDBPyConnection):
-    """Analyze vaccine and symptom matches."""
+def refresh_symptom_status(conn: duckdb.DuckDBPyConnection, full: bool = False):
+    """Bring symptom_status and report_status up to date with the loaded tables.
+
+    symptom_status has one row per (report, vaccine, symptom) with the
+    symptom's mapped FDA terms and its status: 'FDA Documented' if any
+    mapped term is in the vaccine's FDA list, 'Mapped but not in FDA' if it
+    is mapped, else 'Not mapped'. report_status rolls these up per
+    (report, vaccine).
+
+    Only rows whose inputs changed are recomputed: (report, vaccine,
+    symptom) keys added to or removed from vaers_subset, symptoms whose
+    mappings changed, and vaccines whose FDA adverse events changed. With
+    full=True everything is rebuilt.
+    """
+    print("\nRefreshing symptom status...")
     
-    print("\n=== MATCHING ANALYSIS ===")
+    # The status used to be computed on every query by this view
+    conn.execute("DROP VIEW IF EXISTS vaers_fda_analysis")
     
-    # Check exact vaccine name matches
-    print("\n1. Checking vaccine name matches...")
-    vaccine_matches = conn.execute("""
+    conn.begin()
+    try:
+        if full:
+            conn.execute("DELETE FROM symptom_status")
+            conn.execute("DELETE FROM report_status")
+            conn.execute("DELETE FROM status_vaccine_events")
+        
+        conn.execute("""
+            CREATE OR REPLACE TEMP TABLE current_mappings AS
+            SELECT vaers_symptom, list(DISTINCT fda_adverse_event ORDER BY fda_adverse_event) AS fda_adverse_events
+            FROM symptom_mappings
+            GROUP BY vaers_symptom
+        """)
+        conn.execute("""
+            CREATE OR REPLACE TEMP TABLE current_vaccine_events AS
+            SELECT vaccine_name, list(DISTINCT adverse_event ORDER BY adverse_event) AS adverse_events
+            FROM fda_reports
+            GROUP BY vaccine_name
+        """)
+        
+        conn.execute("""
+            CREATE OR REPLACE TEMP TABLE current_keys AS
+            SELECT DISTINCT VAERS_ID, vax_name AS vaccine, symptom AS vaers_symptom
+            FROM vaers_subset_exploded
+        """)
+        
+        # Keys whose status has to be (re)computed or removed
+        conn.execute("""
+            CREATE OR REPLACE TEMP TABLE dirty_status AS
+            WITH stored_keys AS (
+                SELECT VAERS_ID, vaccine, vaers_symptom FROM symptom_status
+            ),
+            changed_vaccines AS (
+                SELECT coalesce(c.vaccine_name, s.vaccine_name) AS vaccine
+                FROM current_vaccine_events c
+                FULL OUTER JOIN status_vaccine_events s ON c.vaccine_name = s.vaccine_name
+                WHERE c.adverse_events IS DISTINCT FROM s.adverse_events
+            )
+            (SELECT * FROM current_keys EXCEPT SELECT * FROM stored_keys)
+            UNION
+            (SELECT * FROM stored_keys EXCEPT SELECT * FROM current_keys)
+            UNION
+            SELECT s.VAERS_ID, s.vaccine, s.vaers_symptom
+            FROM symptom_status s
+            LEFT JOIN current_mappings m ON s.vaers_symptom = m.vaers_symptom
+            WHERE s.mapped_fda_symptoms IS DISTINCT FROM m.fda_adverse_events
+            UNION
+            SELECT s.VAERS_ID, s.vaccine, s.vaers_symptom
+            FROM symptom_status s
+            WHERE s.vaccine IN (SELECT vaccine FROM changed_vaccines)
+        """)
+        dirty_count = conn.execute("SELECT COUNT(*) FROM dirty_status").fetchone()[0]
+        
+        conn.execute("""
+            DELETE FROM symptom_status s
+            WHERE EXISTS (
+                SELECT 1 FROM dirty_status d
+                WHERE d.VAERS_ID = s.VAERS_ID
+                AND d.vaccine IS NOT DISTINCT FROM s.vaccine
+                AND d.vaers_symptom IS NOT DISTINCT FROM s.vaers_symptom
+            )
+        """)
+        # Removed keys are in dirty_status too, so only insert keys still in vaers_subset
+        conn.execute("""
+            INSERT INTO symptom_status
+            WITH status_keys AS (
+                SELECT d.* FROM dirty_status d
+                WHERE EXISTS (
+                    SELECT 1 FROM current_keys c
+                    WHERE c.VAERS_ID = d.VAERS_ID
+                    AND c.vaccine IS NOT DISTINCT FROM d.vaccine
+                    AND c.vaers_symptom IS NOT DISTINCT FROM d.vaers_symptom
+                )
+            ),
+            matched AS (
+                SELECT
+                    k.VAERS_ID,
+                    k.vaccine,
+                    k.vaers_symptom,
+                    m.fda_adverse_events AS mapped_fda_symptoms,
+                    list_sort(list_intersect(m.fda_adverse_events, f.adverse_events)) AS fda_documented_symptoms
+                FROM status_keys k
+                LEFT JOIN current_mappings m ON k.vaers_symptom = m.vaers_symptom
+                LEFT JOIN current_vaccine_events f ON k.vaccine = f.vaccine_name
+            )
+            SELECT
+                *,
+                CASE
+                    WHEN len(fda_documented_symptoms) > 0 THEN 'FDA Documented'
+                    WHEN mapped_fda_symptoms IS NOT NULL THEN 'Mapped but not in FDA'
+                    ELSE 'Not mapped'
+                END AS status
+            FROM matched
+        """)
+        
+        # Roll up again every (report, vaccine) that had a dirty symptom
+        conn.execute("""
+            DELETE FROM report_status r
+            WHERE EXISTS (
+                SELECT 1 FROM dirty_status d
+                WHERE d.VAERS_ID = r.VAERS_ID AND d.vaccine IS NOT DISTINCT FROM r.vaccine
+            )
+        """)
+        conn.execute("""
+            INSERT INTO report_status
+            SELECT
+                s.VAERS_ID,
+                s.vaccine,
+                COUNT(*) AS total_symptoms,
+                COUNT(CASE WHEN status = 'FDA Documented' THEN 1 END) AS fda_documented,
+                COUNT(CASE WHEN status = 'Mapped but not in FDA' THEN 1 END) AS mapped_not_fda,
+                COUNT(CASE WHEN status = 'Not mapped' THEN 1 END) AS not_mapped,
+                100.0 * COUNT(CASE WHEN status = 'FDA Documented' THEN 1 END) / COUNT(*) AS match_rate
+            FROM symptom_status s
+            WHERE EXISTS (
+                SELECT 1 FROM dirty_status d
+                WHERE d.VAERS_ID = s.VAERS_ID AND d.vaccine IS NOT DISTINCT FROM s.vaccine
+            )
+            GROUP BY s.VAERS_ID, s.vaccine
+        """)
+        
+        conn.execute("DELETE FROM status_vaccine_events")
+        conn.execute("INSERT INTO status_vaccine_events SELECT * FROM current_vaccine_events")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for temp_table in ['current_mappings', 'current_vaccine_events', 'current_keys', 'dirty_status']:
+            conn.execute(f"DROP TABLE IF EXISTS {temp_table}")
+    
+    status_count = conn.execute("SELECT COUNT(*) FROM symptom_status").fetchone()[0]
+    print(f"Recomputed {dirty_count:,} of {status_count:,} symptom status rows")
+
+def apply_enum_types(conn: duckdb.DuckDBPyConnection):
+    """Retype the columns in ENUM_COLUMNS as ENUMs holding the values in the data.
+
+    Tables are loaded with VARCHAR columns. Nothing is rewritten when every
+    column already uses its ENUM and the set of values has not changed.
+    DuckDB cannot add values to an ENUM, so otherwise the types are
+    recreated and the tables using them are rewritten in one transaction;
+    the tables in DERIVED_ENUM_COLUMNS are emptied, so the next
+    refresh_symptom_status rebuilds them in full.
+    """
+    print("\nApplying ENUM types...")
+    
+    column_types = {
+        (table, column): data_type
+        for table, column, data_type in conn.execute("""
+            SELECT table_name, column_name, data_type
+            FROM duckdb_columns()
+            WHERE database_name = current_database() AND schema_name = 'main'
+        """).fetchall()
+    }
+    existing_types = {row[0] for row in conn.execute("""
+        SELECT type_name FROM duckdb_types()
+        WHERE database_name = current_database() AND schema_name = 'main'
+    """).fetchall()}
+    
+    def is_list(table, column):
+        return column_types[(table, column)].endswith('[]')
+    
+    # Distinct, sorted values of an ENUM's columns, so ENUM order matches string order
+    value_queries = {}
+    for type_name, columns in ENUM_COLUMNS.items():
+        parts = [
+            f"SELECT CAST(value AS VARCHAR) AS value FROM "
+            f"(SELECT {f'UNNEST({column})' if is_list(table, column) else column} AS value FROM {table})"
+            for table, column in columns
+        ]
+        value_queries[type_name] = (
+            f"SELECT DISTINCT value FROM ({' UNION ALL '.join(parts)}) "
+            f"WHERE value IS NOT NULL ORDER BY value"
+        )
+    
+    enum_types = {
+        (table, column): type_name
+        for enum_columns in (ENUM_COLUMNS, DERIVED_ENUM_COLUMNS)
+        for type_name, columns in enum_columns.items() for table, column in columns
+    }
+    up_to_date = all(
+        column_types[(table, column)].startswith('ENUM') for table, column in enum_types
+    )
+    for type_name, query in value_queries.items():
+        if not up_to_date:
+            break
+        values = [row[0] for row in conn.execute(query).fetchall()]
+        up_to_date = (type_name in existing_types and
+                      conn.execute(f"SELECT enum_range(NULL::{type_name})").fetchone()[0] == values)
+    if up_to_date:
+        print("ENUM types are up to date")
+        return
+    
+    tables = list(dict.fromkeys(table for table, _ in enum_types))
+    derived_tables = {table for columns in DERIVED_ENUM_COLUMNS.values() for table, _ in columns}
+    
+    def rewrite(table, typed):
+        # Copy table with its ENUM columns cast to VARCHAR or to their ENUM,
+        # then put the copy in its place
+        select_list = []
+        for (column_table, column), data_type in column_types.items():
+            if column_table != table:
+                continue
+            if (table, column) in enum_types:
+                target = enum_types[(table, column)] if typed else 'VARCHAR'
+                if is_list(table, column):
+                    target += '[]'
+                select_list.append(f"CAST({column} AS {target}) AS {column}")
+            else:
+                select_list.append(column)
+        conn.execute(f"CREATE OR REPLACE TABLE {table}_staging AS SELECT {', '.join(select_list)} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_staging RENAME TO {table}")
+    
+    conn.begin()
+    try:
+        # Indexes go with the old tables; main() recreates them
+        for table in derived_tables:
+            conn.execute(f"DELETE FROM {table}")
+        for table in tables:
+            rewrite(table, typed=False)
+        for type_name, query in value_queries.items():
+            conn.execute(f"DROP TYPE IF EXISTS {type_name}")
+            conn.execute(f"CREATE TYPE {type_name} AS ENUM ({query})")
+        for table in tables:
+            rewrite(table, typed=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    for type_name in ENUM_COLUMNS:
+        size = conn.execute(f"SELECT len(enum_range(NULL::{type_name}))").fetchone()[0]
+        print(f"{type_name}: {size:,} values")
+    print("Symptom status tables emptied; they are rebuilt on refresh")
+
+def create_indexes(conn: duckdb.DuckDBPyConnection):
+    """Create the ART indexes of the indexed layout"""
+    print("\nCreating indexes...")
+    for index_name, (table, column) in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table}({column})")
+
+def cluster_tables(conn: duckdb.DuckDBPyConnection):
+    """Drop the ART indexes and rewrite each table sorted by its CLUSTER_KEYS.
+
+    Tables whose rows are already in that order are left as they are, so
+    rerunning with unchanged data does not rewrite anything.
+    """
+    print("\nClustering tables...")
+    for index_name in INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    
+    for table, key in CLUSTER_KEYS.items():
+        sort_key = f"struct_pack({', '.join(f'{column} := {column}' for column in key)})"
+        out_of_order = conn.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT {sort_key} AS sort_key, LAG({sort_key}) OVER (ORDER BY rowid) AS previous_key
+                FROM {table}
+            )
+            WHERE previous_key > sort_key
+        """).fetchone()[0]
+        if out_of_order == 0:
+            continue
+        
+        conn.begin()
+        try:
+            conn.execute(f"CREATE OR REPLACE TABLE {table}_staging AS SELECT * FROM {table} ORDER BY {', '.join(key)}")
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {table}_staging RENAME TO {table}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Sorted {table} by {', '.join(key)}")
+
+# Queries run by analyze_matches, also timed by benchmark_table_layout.py
+ANALYSIS_QUERIES = {
+    # Exact vaccine name matches
+    "vaccine_matches": """
         WITH vaers_vaccines AS (
-            SELECT DISTINCT vax_name FROM vaers_subset
+            SELECT DISTINCT UNNEST(vax_names) AS vax_name FROM vaers_subset
         ),
         fda_vaccines AS (
             SELECT DISTINCT vaccine_name FROM fda_reports
@@ -210,51 +721,18 @@ def analyze_matches(conn: duckdb.DuckDBPyConnection):
             COUNT(DISTINCT CASE WHEN v.vax_name = f.vaccine_name THEN v.vax_name END) as exact_matches
         FROM vaers_vaccines v
         FULL OUTER JOIN fda_vaccines f ON v.vax_name = f.vaccine_name
-    """).fetchone()
-    
-    print(f"VAERS vaccines: {vaccine_matches[0]}")
-    print(f"FDA vaccines: {vaccine_matches[1]}")
-    print(f"Exact matches: {vaccine_matches[2]}")
-    
-    # Show matched vaccines
-    print("\nMatched vaccines:")
-    matched = conn.execute("""
+    """,
+    "matched_vaccines": """
         SELECT DISTINCT 
             v.vax_name as vaccine,
             COUNT(DISTINCT v.VAERS_ID) as vaers_reports,
             COUNT(DISTINCT f.adverse_event) as fda_adverse_events
-        FROM vaers_subset v
+        FROM (SELECT VAERS_ID, UNNEST(vax_names) AS vax_name FROM vaers_subset) v
         INNER JOIN fda_reports f ON v.vax_name = f.vaccine_name
         GROUP BY v.vax_name
         ORDER BY vaers_reports DESC
-    """).fetchdf()
-    print(matched.to_string(index=False))
-    
-    # Analyze symptom matching
-    print("\n2. Analyzing symptom matching...")
-    
-    # Create the main analysis view
-    conn.execute("""
-        CREATE OR REPLACE VIEW vaers_fda_analysis AS
-        SELECT 
-            v.VAERS_ID,
-            v.vax_name as vaccine,
-            v.symptom as vaers_symptom,
-            sm.fda_adverse_event as mapped_fda_symptom,
-            CASE 
-                WHEN f.adverse_event IS NOT NULL THEN 'FDA Documented'
-                WHEN sm.fda_adverse_event IS NOT NULL THEN 'Mapped but not in FDA'
-                ELSE 'Not mapped'
-            END as status
-        FROM vaers_subset v
-        LEFT JOIN symptom_mappings sm ON v.symptom = sm.vaers_symptom
-        LEFT JOIN fda_reports f ON 
-            v.vax_name = f.vaccine_name 
-            AND sm.fda_adverse_event = f.adverse_event
-    """)
-    
-    # Get overall statistics
-    stats = conn.execute("""
+    """,
+    "symptom_stats": """
         SELECT 
             COUNT(DISTINCT VAERS_ID) as total_reports,
             COUNT(DISTINCT vaccine) as total_vaccines,
@@ -262,8 +740,56 @@ def analyze_matches(conn: duckdb.DuckDBPyConnection):
             COUNT(CASE WHEN status = 'FDA Documented' THEN 1 END) as fda_documented,
             COUNT(CASE WHEN status = 'Mapped but not in FDA' THEN 1 END) as mapped_not_fda,
             COUNT(CASE WHEN status = 'Not mapped' THEN 1 END) as not_mapped
-        FROM vaers_fda_analysis
-    """).fetchone()
+        FROM symptom_status
+    """,
+    "high_match_reports": """
+        SELECT 
+            VAERS_ID,
+            vaccine,
+            total_symptoms,
+            fda_documented,
+            ROUND(match_rate, 1) as match_rate
+        FROM report_status
+        WHERE total_symptoms >= 3  -- At least 3 symptoms
+        AND match_rate >= 50  -- At least 50% FDA documented
+        ORDER BY match_rate DESC, total_symptoms DESC, VAERS_ID, vaccine
+        LIMIT 10
+    """,
+    # Takes the VAERS_ID as parameter
+    "report_details": """
+        SELECT 
+            vaers_symptom,
+            array_to_string(mapped_fda_symptoms, ', ') as mapped_fda_symptoms,
+            status
+        FROM symptom_status
+        WHERE VAERS_ID = ?
+        ORDER BY status, vaers_symptom
+    """,
+}
+
+def analyze_matches(conn: duckdb.DuckDBPyConnection):
+    """Analyze vaccine and symptom matches."""
+    
+    print("\n=== MATCHING ANALYSIS ===")
+    
+    # Check exact vaccine name matches
+    print("\n1. Checking vaccine name matches...")
+    vaccine_matches = conn.execute(ANALYSIS_QUERIES["vaccine_matches"]).fetchone()
+    
+    print(f"VAERS vaccines: {vaccine_matches[0]}")
+    print(f"FDA vaccines: {vaccine_matches[1]}")
+    print(f"Exact matches: {vaccine_matches[2]}")
+    
+    # Show matched vaccines
+    print("\nMatched vaccines:")
+    matched = conn.execute(ANALYSIS_QUERIES["matched_vaccines"]).fetchdf()
+    print(matched.to_string(index=False))
+    
+    # Analyze symptom matching
+    print("\n2. Analyzing symptom matching...")
+    
+    # Get overall statistics
+    stats = conn.execute(ANALYSIS_QUERIES["symptom_stats"]).fetchone()
     
     print(f"\nTotal VAERS reports: {stats[0]:,}")
     print(f"Total vaccines: {stats[1]}")
@@ -274,23 +800,7 @@ def analyze_matches(conn: duckdb.DuckDBPyConnection):
     
     # Show reports with high FDA match rate
     print("\n3. Reports with high FDA documentation rate:")
-    high_match_reports = conn.execute("""
-        WITH report_stats AS (
-            SELECT 
-                VAERS_ID,
-                vaccine,
-                COUNT(*) as total_symptoms,
-                COUNT(CASE WHEN status = 'FDA Documented' THEN 1 END) as fda_documented,
-                ROUND(100.0 * COUNT(CASE WHEN status = 'FDA Documented' THEN 1 END) / COUNT(*), 1) as match_rate
-            FROM vaers_fda_analysis
-            GROUP BY VAERS_ID, vaccine
-            HAVING COUNT(*) >= 3  -- At least 3 symptoms
-        )
-        SELECT * FROM report_stats
-        WHERE match_rate >= 50  -- At least 50% FDA documented
-        ORDER BY match_rate DESC, total_symptoms DESC
-        LIMIT 10
-    """).fetchdf()
+    high_match_reports = conn.execute(ANALYSIS_QUERIES["high_match_reports"]).fetchdf()
     
     if not high_match_reports.empty:
         print(high_match_reports.to_string(index=False))
@@ -302,37 +812,44 @@ def analyze_matches(conn: duckdb.DuckDBPyConnection):
         example_id = high_match_reports.iloc[0]['VAERS_ID']
         print(f"\n4. Example report details (VAERS_ID: {example_id}):")
         
-        details = conn.execute("""
-            SELECT 
-                vaers_symptom,
-                mapped_fda_symptom,
-                status
-            FROM vaers_fda_analysis
-            WHERE VAERS_ID = ?
-            ORDER BY status, vaers_symptom
-        """, [example_id]).fetchdf()
+        details = conn.execute(ANALYSIS_QUERIES["report_details"], [example_id]).fetchdf()
         
         print(details.to_string(index=False))
 
 def main():
+    parser = argparse.ArgumentParser(description="Load the JSON data into DuckDB and analyze matches")
+    parser.add_argument('--force', action='store_true',
+                        help='Reload every table even if its source file is unchanged, '
+                             'and rebuild the symptom status tables from scratch')
+    parser.add_argument('--layout', choices=['indexed', 'clustered'], default='indexed',
+                        help='indexed: ART indexes on the join columns; clustered: no indexes, '
+                             'status tables sorted by vaccine (see benchmark_table_layout.py)')
+    args = parser.parse_args()
+    
     # Initialize database
     conn = setup_database()
     
-    # Load data
+    # Load data; tables whose source file is unchanged are kept as they are
     success = True
-    success &= load_fda_reports(conn, "fda_reports.json")
-    success &= load_vaers_subset(conn, "vaers_subset.json")
-    success &= load_symptom_mappings(conn, "symptom_mappings.json")
+    success &= load_fda_reports(conn, "fda_reports.json", force=args.force)
+    success &= load_vaers_subset(conn, os.path.basename(find_subset_file("json_data")), force=args.force)
+    success &= load_symptom_mappings(conn, "symptom_mappings.json", force=args.force)
     
     if not success:
         print("\nERROR: Failed to load all data files")
         return
     
-    # Create indexes for better performance
-    print("\nCreating indexes...")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_vaers_vax ON vaers_subset(vax_name)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_fda_vax ON fda_reports(vaccine_name)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_symptom_map ON symptom_mappings(vaers_symptom)")
+    # Vaccine, symptom and FDA term columns become ENUMs
+    apply_enum_types(conn)
+    
+    # Update the precomputed symptom status the analysis reads from
+    refresh_symptom_status(conn, full=args.force)
+    
+    # Physical layout of the tables
+    if args.layout == 'clustered':
+        cluster_tables(conn)
+    else:
+        create_indexes(conn)
     
     # Analyze matches
     analyze_matches(conn)
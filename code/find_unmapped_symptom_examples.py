@@ -19,7 +19,7 @@ def find_unmapped_symptom_examples():
             v.symptom,
             COUNT(*) as frequency,
             v.vax_name as vaccine
-        FROM vaers_subset v
+        FROM vaers_subset_exploded v
         WHERE NOT EXISTS (
             SELECT 1 FROM symptom_mappings sm 
             WHERE sm.vaers_symptom = v.symptom
@@ -41,7 +41,7 @@ def find_unmapped_symptom_examples():
         # Get a sample VAERS ID for this symptom
         vaers_id_result = conn.execute("""
             SELECT VAERS_ID FROM vaers_subset 
-            WHERE symptom = ? AND vax_name = ?
+            WHERE list_contains(symptoms, ?) AND list_contains(vax_names, ?)
             LIMIT 1
         """, [symptom, vaccine]).fetchone()
         
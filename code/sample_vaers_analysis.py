@@ -4,6 +4,8 @@ Get random samples of VAERS data in three categories:
 1. Fully matched - symptoms are documented in FDA adverse events for same vaccine
 2. Mapped but not matched - symptoms were processed but don't match FDA events
 3. Not mapped - symptoms haven't been processed yet
+
+Reads the symptom_status table that database_fixed.py keeps up to date.
 """
 
 import duckdb
@@ -22,17 +24,13 @@ def get_samples():
     
     fully_matched = conn.execute("""
         WITH matched_reports AS (
-            SELECT DISTINCT
-                v.VAERS_ID,
-                v.vax_name as vaccine,
-                v.symptom as vaers_symptom,
-                sm.fda_adverse_event,
-                f.adverse_event as fda_documented
-            FROM vaers_subset v
-            INNER JOIN symptom_mappings sm ON v.symptom = sm.vaers_symptom
-            INNER JOIN fda_reports f ON 
-                v.vax_name = f.vaccine_name 
-                AND sm.fda_adverse_event = f.adverse_event
+            SELECT 
+                VAERS_ID,
+                vaccine,
+                vaers_symptom,
+                UNNEST(fda_documented_symptoms) as fda_adverse_event
+            FROM symptom_status
+            WHERE status = 'FDA Documented'
         )
         SELECT 
             VAERS_ID,
@@ -58,18 +56,13 @@ def get_samples():
     
     mapped_not_matched = conn.execute("""
         WITH mapped_unmatched AS (
-            SELECT DISTINCT
-                v.VAERS_ID,
-                v.vax_name as vaccine,
-                v.symptom as vaers_symptom,
-                sm.fda_adverse_event
-            FROM vaers_subset v
-            INNER JOIN symptom_mappings sm ON v.symptom = sm.vaers_symptom
-            WHERE NOT EXISTS (
-                SELECT 1 FROM fda_reports f 
-                WHERE f.vaccine_name = v.vax_name 
-                AND f.adverse_event = sm.fda_adverse_event
-            )
+            SELECT 
+                VAERS_ID,
+                vaccine,
+                vaers_symptom,
+                UNNEST(mapped_fda_symptoms) as fda_adverse_event
+            FROM symptom_status
+            WHERE status = 'Mapped but not in FDA'
         )
         SELECT 
             VAERS_ID,
@@ -96,22 +89,12 @@ def get_samples():
     print("-" * 60)
     
     not_mapped = conn.execute("""
-        WITH unmapped AS (
-            SELECT DISTINCT
-                v.VAERS_ID,
-                v.vax_name as vaccine,
-                v.symptom as vaers_symptom
-            FROM vaers_subset v
-            WHERE NOT EXISTS (
-                SELECT 1 FROM symptom_mappings sm 
-                WHERE sm.vaers_symptom = v.symptom
-            )
-        )
         SELECT 
             VAERS_ID,
             vaccine,
             STRING_AGG(DISTINCT vaers_symptom, ', ') as symptoms
-        FROM unmapped
+        FROM symptom_status
+        WHERE status = 'Not mapped'
         GROUP BY VAERS_ID, vaccine
         HAVING COUNT(DISTINCT vaers_symptom) BETWEEN 2 AND 5  -- Interesting but readable
         ORDER BY RANDOM()
@@ -128,30 +111,15 @@ def get_samples():
     # Summary statistics
     print("\n=== SUMMARY STATISTICS ===")
     stats = conn.execute("""
-        WITH categorized AS (
-            SELECT 
-                v.VAERS_ID,
-                v.symptom,
-                CASE 
-                    WHEN EXISTS (
-                        SELECT 1 FROM symptom_mappings sm 
-                        INNER JOIN fda_reports f ON f.adverse_event = sm.fda_adverse_event
-                        WHERE sm.vaers_symptom = v.symptom 
-                        AND f.vaccine_name = v.vax_name
-                    ) THEN 'Fully Matched'
-                    WHEN EXISTS (
-                        SELECT 1 FROM symptom_mappings sm 
-                        WHERE sm.vaers_symptom = v.symptom
-                    ) THEN 'Mapped Not Matched'
-                    ELSE 'Not Mapped'
-                END as category
-            FROM vaers_subset v
-        )
         SELECT 
-            category,
+            CASE status
+                WHEN 'FDA Documented' THEN 'Fully Matched'
+                WHEN 'Mapped but not in FDA' THEN 'Mapped Not Matched'
+                ELSE 'Not Mapped'
+            END as category,
             COUNT(DISTINCT VAERS_ID) as unique_reports,
             COUNT(*) as symptom_instances
-        FROM categorized
+        FROM symptom_status
         GROUP BY category
     """).fetchall()
     
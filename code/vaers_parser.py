@@ -1,296 +1,1083 @@
-import os
-import json
-import duckdb
-import pandas as pd
-from pathlib import Path
-from typing import Dict, List, Union
-import re
-from collections import defaultdict
-
-
-class VAERSParser:
-    def __init__(self, data_folder: Union[str, Path]):
-        self.data_folder = Path(data_folder)
-        if not self.data_folder.exists():
-            raise ValueError(f"Data folder not found: {self.data_folder}")
-
-    def find_vaers_files(self) -> Dict[int, Dict[str, Path]]:
-        """Find VAERS files grouped by year, only keeping complete sets"""
-        all_files = list(self.data_folder.glob("*VAERS*.csv"))
-        
-        # Group files by year
-        years = {}
-        for file_path in all_files:
-            # Extract year from filename
-            year_match = re.search(r'(\d{4})', file_path.name)
-            if not year_match:
-                continue
-            year = int(year_match.group(1))
-            
-            if year not in years:
-                years[year] = {}
-            
-            # Categorize file type
-            if 'VAERSDATA' in file_path.name:
-                years[year]['data'] = file_path
-            elif 'VAERSVAX' in file_path.name:
-                years[year]['vax'] = file_path
-            elif 'VAERSSYMPTOMS' in file_path.name:
-                years[year]['symptoms'] = file_path
-        
-        # Only keep years with complete sets (data, vax, symptoms)
-        complete_years = {}
-        for year, files in years.items():
-            if all(key in files for key in ['data', 'vax', 'symptoms']):
-                complete_years[year] = files
-                print(f"Year {year}: Complete set found")
-                for file_type, file_path in files.items():
-                    print(f"  {file_type}: {file_path.name}")
-            else:
-                missing = [key for key in ['data', 'vax', 'symptoms'] if key not in files]
-                print(f"Year {year}: Incomplete set, missing: {missing}")
-        
-        return complete_years
-
-    def load_vaers_data_with_duckdb(self, complete_years: Dict[int, Dict[str, Path]]) -> duckdb.DuckDBPyConnection:
-        """Load VAERS data using DuckDB"""
-        conn = duckdb.connect(':memory:')
-        
-        for year, files in complete_years.items():
-            print(f"Loading {year} data into DuckDB...")
-            
-            # Load each file type for this year
-            for file_type, file_path in files.items():
-                table_name = f"{file_type}_{year}"
-                try:
-                    # Try different encodings
-                    for encoding in ['utf-8', 'latin-1', 'cp1252']:
-                        try:
-                            conn.execute(f"""
-                                CREATE TABLE {table_name} AS 
-                                SELECT *, '{file_path.name}' as source_file
-                                FROM read_csv_auto('{file_path}', encoding='{encoding}', ignore_errors=true)
-                            """)
-                            print(f"  {file_type}: {conn.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]} records")
-                            break
-                        except Exception as e:
-                            if encoding == 'cp1252':  # Last encoding
-                                print(f"  Error loading {file_path}: {e}")
-                            continue
-                except Exception as e:
-                    print(f"  Failed to load {file_path}: {e}")
-        
-        return conn
-
-    def transform_symptoms_wide_to_long(self, conn: duckdb.DuckDBPyConnection) -> None:
-        """Transform symptoms from wide format to long format using DuckDB"""
-        print("Transforming symptoms from wide to long format...")
-        
-        # Get all symptoms tables
-        tables = conn.execute("SHOW TABLES").fetchall()
-        symptoms_tables = [table[0] for table in tables if table[0].startswith('symptoms_')]
-        
-        if not symptoms_tables:
-            print("No symptoms tables found")
-            return
-        
-        # Create unified long symptoms table
-        conn.execute("DROP TABLE IF EXISTS symptoms_long")
-        
-        union_queries = []
-        for table_name in symptoms_tables:
-            # Create UNPIVOT query for each symptoms table
-            query = f"""
-            SELECT 
-                VAERS_ID,
-                symptom_num,
-                SYMPTOM,
-                source_file
-            FROM (
-                SELECT 
-                    VAERS_ID,
-                    source_file,
-                    1 as symptom_num, SYMPTOM1 as SYMPTOM FROM {table_name} WHERE SYMPTOM1 IS NOT NULL AND SYMPTOM1 != ''
-                UNION ALL
-                SELECT 
-                    VAERS_ID,
-                    source_file,
-                    2 as symptom_num, SYMPTOM2 as SYMPTOM FROM {table_name} WHERE SYMPTOM2 IS NOT NULL AND SYMPTOM2 != ''
-                UNION ALL
-                SELECT 
-                    VAERS_ID,
-                    source_file,
-                    3 as symptom_num, SYMPTOM3 as SYMPTOM FROM {table_name} WHERE SYMPTOM3 IS NOT NULL AND SYMPTOM3 != ''
-                UNION ALL
-                SELECT 
-                    VAERS_ID,
-                    source_file,
-                    4 as symptom_num, SYMPTOM4 as SYMPTOM FROM {table_name} WHERE SYMPTOM4 IS NOT NULL AND SYMPTOM4 != ''
-                UNION ALL
-                SELECT 
-                    VAERS_ID,
-                    source_file,
-                    5 as symptom_num, SYMPTOM5 as SYMPTOM FROM {table_name} WHERE SYMPTOM5 IS NOT NULL AND SYMPTOM5 != ''
-            )
-            """
-            union_queries.append(f"({query})")
-        
-        # Combine all years
-        final_query = f"""
-        CREATE TABLE symptoms_long AS
-        SELECT VAERS_ID, SYMPTOM, COUNT(*) as symptom_count, source_file
-        FROM (
-            {' UNION ALL '.join(union_queries)}
-        )
-        GROUP BY VAERS_ID, SYMPTOM, source_file
-        """
-        
-        conn.execute(final_query)
-        
-        count = conn.execute("SELECT COUNT(*) FROM symptoms_long").fetchone()[0]
-        unique_symptoms = conn.execute("SELECT COUNT(DISTINCT SYMPTOM) FROM symptoms_long").fetchone()[0]
-        print(f"Created {count} symptom records with {unique_symptoms} unique symptoms")
-
-
-    def create_final_merged_table(self, conn: duckdb.DuckDBPyConnection) -> None:
-        """Create final merged table with all VAERS data"""
-        print("Creating final merged dataset...")
-        
-        # Get all table names
-        tables = conn.execute("SHOW TABLES").fetchall()
-        table_names = [table[0] for table in tables]
-        
-        # Find data and vax tables
-        data_tables = [t for t in table_names if t.startswith('data_')]
-        vax_tables = [t for t in table_names if t.startswith('vax_')]
-        
-        # Union all data tables
-        if data_tables:
-            data_union = ' UNION ALL '.join([f'SELECT * FROM {t}' for t in data_tables])
-            conn.execute(f"CREATE TABLE all_data AS ({data_union})")
-        
-        # Union all vax tables  
-        if vax_tables:
-            vax_union = ' UNION ALL '.join([f'SELECT * FROM {t}' for t in vax_tables])
-            conn.execute(f"CREATE TABLE all_vax AS ({vax_union})")
-        
-        # Create final merged table with symptoms as rows, not columns
-        merge_query = """
-        CREATE TABLE final_merged AS
-        SELECT 
-            v.VAERS_ID,
-            v.VAX_TYPE, v.VAX_MANU, v.VAX_LOT, v.VAX_DOSE_SERIES, 
-            v.VAX_ROUTE, v.VAX_SITE, v.VAX_NAME, v.ORDER as VAX_ORDER,
-            d.RECVDATE, d.STATE, d.AGE_YRS, d.SEX, d.SYMPTOM_TEXT,
-            d.DIED, d.L_THREAT, d.ER_VISIT, d.HOSPITAL, d.DISABLE,
-            d.OTHER_MEDS, d.CUR_ILL, d.HISTORY,
-            s.SYMPTOM, s.symptom_count
-        FROM all_vax v
-        LEFT JOIN all_data d ON v.VAERS_ID = d.VAERS_ID
-        LEFT JOIN symptoms_long s ON v.VAERS_ID = s.VAERS_ID
-        """
-        
-        conn.execute(merge_query)
-        
-        count = conn.execute("SELECT COUNT(*) FROM final_merged").fetchone()[0]
-        print(f"Final merged table created with {count} records (including symptom rows)")
-
-    def export_to_duckdb(self, conn: duckdb.DuckDBPyConnection, output_file: str = "../intermediate_results/vaers_database.duckdb"):
-        """Export merged data to DuckDB database file"""
-        print("Exporting data to DuckDB database...")
-        
-        # Get summary statistics
-        summary_stats = conn.execute("""
-        SELECT 
-            COUNT(*) as total_records,
-            COUNT(DISTINCT VAERS_ID) as unique_vaers_ids,
-            COUNT(DISTINCT VAX_NAME) as unique_vaccines
-        FROM final_merged
-        """).fetchone()
-        
-        # Create persistent database
-        persistent_conn = duckdb.connect(output_file)
-        
-        # Copy all tables to the persistent database
-        tables_to_copy = ['final_merged', 'symptoms_long', 'all_data', 'all_vax']
-        
-        for table in tables_to_copy:
-            try:
-                # Check if table exists in memory database
-                result = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
-                if result[0] > 0:
-                    # Export table to persistent database
-                    df = conn.execute(f"SELECT * FROM {table}").fetchdf()
-                    persistent_conn.execute(f"CREATE TABLE {table} AS SELECT * FROM df")
-                    print(f"  Exported {table}: {len(df)} records")
-            except Exception as e:
-                print(f"  Skipped {table}: {e}")
-        
-        # Create summary table
-        summary_data = pd.DataFrame([{
-            "total_records": int(summary_stats[0]),
-            "unique_vaers_ids": int(summary_stats[1]),
-            "unique_vaccines": int(summary_stats[2]),
-            "processing_date": str(pd.Timestamp.now())
-        }])
-        persistent_conn.execute("CREATE TABLE processing_summary AS SELECT * FROM summary_data")
-        
-        persistent_conn.close()
-        
-        summary = {
-            "total_records": int(summary_stats[0]),
-            "unique_vaers_ids": int(summary_stats[1]),
-            "unique_vaccines": int(summary_stats[2]),
-            "processing_date": str(pd.Timestamp.now())
-        }
-        
-        print(f"Database exported to: {output_file}")
-        print(f"Summary: {summary}")
-        
-        return output_file
-
-    def process_all_vaers_data(self, output_file: str = "../intermediate_results/vaers_database.duckdb"):
-        """Complete processing pipeline using DuckDB"""
-        conn = None
-        try:
-            # Find complete year sets
-            complete_years = self.find_vaers_files()
-            
-            if not complete_years:
-                raise ValueError("No complete VAERS year sets found in data folder")
-            
-            # Load data into DuckDB
-            conn = self.load_vaers_data_with_duckdb(complete_years)
-            
-            # Transform symptoms to long format
-            self.transform_symptoms_wide_to_long(conn)
-            
-            # Create final merged table
-            self.create_final_merged_table(conn)
-            
-            # Export to DuckDB database
-            output_file = self.export_to_duckdb(conn, output_file)
-            
-            return output_file
-            
-        except Exception as e:
-            print(f"Error processing VAERS data: {e}")
-            raise
-        finally:
-            if conn:
-                conn.close()
-
-
-def main():
-    try:
-        parser = VAERSParser("../vaers_data/vaers_data")
-        output_file = parser.process_all_vaers_data()
-        print(f"\n✓ VAERS data processing complete!")
-        print(f"Output saved to: {output_file}")
-        
-    except Exception as e:
-        print(f"✗ Error: {e}")
-
-
-if __name__ == "__main__":
+import os
+import csv
+import json
+import hashlib
+import io
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import resource
+import zipfile
+import duckdb
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from csv_encoding import detect_encoding, source_stat
+
+
+# Column types of the published VAERS CSVs (see the VAERS data use guide).
+# Declaring them up front means DuckDB does not have to infer types from a
+# sample of every file, and every year ends up with the same schema. Non-
+# VARCHAR columns are read as text and converted with TRY_CAST/TRY_STRPTIME,
+# so a malformed value becomes NULL instead of dropping the whole report.
+VAERS_COLUMN_TYPES = {
+    'data': {
+        'VAERS_ID': 'BIGINT', 'RECVDATE': 'DATE', 'STATE': 'VARCHAR',
+        'AGE_YRS': 'DOUBLE', 'CAGE_YR': 'DOUBLE', 'CAGE_MO': 'DOUBLE',
+        'SEX': 'VARCHAR', 'RPT_DATE': 'DATE', 'SYMPTOM_TEXT': 'VARCHAR',
+        'DIED': 'VARCHAR', 'DATEDIED': 'DATE', 'L_THREAT': 'VARCHAR',
+        'ER_VISIT': 'VARCHAR', 'HOSPITAL': 'VARCHAR', 'HOSPDAYS': 'DOUBLE',
+        'X_STAY': 'VARCHAR', 'DISABLE': 'VARCHAR', 'RECOVD': 'VARCHAR',
+        'VAX_DATE': 'DATE', 'ONSET_DATE': 'DATE', 'NUMDAYS': 'DOUBLE',
+        'LAB_DATA': 'VARCHAR', 'V_ADMINBY': 'VARCHAR', 'V_FUNDBY': 'VARCHAR',
+        'OTHER_MEDS': 'VARCHAR', 'CUR_ILL': 'VARCHAR', 'HISTORY': 'VARCHAR',
+        'PRIOR_VAX': 'VARCHAR', 'SPLTTYPE': 'VARCHAR', 'FORM_VERS': 'INTEGER',
+        'TODAYS_DATE': 'DATE', 'BIRTH_DEFECT': 'VARCHAR', 'OFC_VISIT': 'VARCHAR',
+        'ER_ED_VISIT': 'VARCHAR', 'ALLERGIES': 'VARCHAR',
+    },
+    'vax': {
+        'VAERS_ID': 'BIGINT', 'VAX_TYPE': 'VARCHAR', 'VAX_MANU': 'VARCHAR',
+        'VAX_LOT': 'VARCHAR', 'VAX_DOSE_SERIES': 'VARCHAR', 'VAX_ROUTE': 'VARCHAR',
+        'VAX_SITE': 'VARCHAR', 'VAX_NAME': 'VARCHAR',
+    },
+    'symptoms': {
+        'VAERS_ID': 'BIGINT',
+        **{f'SYMPTOM{i}': 'VARCHAR' for i in range(1, 6)},
+        **{f'SYMPTOMVERSION{i}': 'DOUBLE' for i in range(1, 6)},
+    },
+}
+
+VAERS_DATE_FORMAT = '%m/%d/%Y'
+
+# DuckDB reads utf-8 and latin-1 natively; cp1252 comes from the encodings
+# extension, which uses the ICU converter name. Without that extension such
+# files are transcoded to utf-8 first.
+DUCKDB_ENCODINGS = {
+    'utf-8': 'utf-8',
+    'latin-1': 'latin-1',
+    'cp1252': 'windows-1252-2000',
+}
+
+# Tables copied to the output database; every row carries its VAERS year so
+# an incremental run can replace just the years whose source files changed
+OUTPUT_TABLES = ['final_merged', 'symptoms_long', 'all_data', 'all_vax']
+
+# Hive partition columns for the Parquet export. Report-level tables have no
+# single vaccine type, so they are only partitioned by year.
+PARQUET_PARTITIONS = {
+    'final_merged': ['year', 'VAX_TYPE'],
+    'all_vax': ['year', 'VAX_TYPE'],
+    'all_data': ['year'],
+    'symptoms_long': ['year'],
+}
+
+# Integer symptom_id <-> MedDRA term, used when symptoms are dictionary-encoded
+SYMPTOM_DICTIONARY_TABLE = 'symptom_dictionary'
+
+# Wall time, row counts and peak memory of every pipeline stage, appended on
+# every run so slowdowns can be traced back to the stage and year they hit
+STAGE_METRICS_TABLE = 'processing_stage_metrics'
+
+# Records size, mtime and content hash of every source CSV in the output database
+MANIFEST_TABLE = 'ingest_manifest'
+
+# Content hash of every source CSV the Parquet dataset was last exported from.
+# Kept next to the dataset, since it can fall out of step with the database
+# (e.g. parquet_dir added, moved or deleted between runs).
+PARQUET_STATE_FILE = '_source_files.json'
+
+
+class VAERSParser:
+    def __init__(self, data_folder: Union[str, Path], parallel: bool = False,
+                 max_workers: Optional[int] = None, encode_symptoms: bool = False,
+                 normalized: bool = False, working_db: Optional[str] = None,
+                 memory_limit: Optional[str] = None, temp_directory: Optional[str] = None):
+        self.data_folder = Path(data_folder)
+        if not self.data_folder.exists():
+            raise ValueError(f"Data folder not found: {self.data_folder}")
+        # Parallel ingestion loads every CSV concurrently, at most
+        # max_workers files at a time (defaults to the CPU count)
+        self.parallel = parallel
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Published ZIP archives found by find_vaers_files, mapped to the
+        # fsspec protocol DuckDB reads their members through. The archives
+        # stay open while their members are in use; close_archives closes them.
+        self.archive_protocols: Dict[str, str] = {}
+        self.archives: List[zipfile.ZipFile] = []
+        # Bounded-memory mode: build in an on-disk working database instead of
+        # ':memory:', cap DuckDB at memory_limit (e.g. '6GB') and spill
+        # anything beyond it to temp_directory
+        self.working_db = working_db
+        self.memory_limit = memory_limit
+        self.temp_directory = temp_directory
+        # One entry per stage (and per year/file where the stage works per
+        # year), collected by process_all_vaers_data
+        self.stage_metrics: List[dict] = []
+        # Store symptoms_long.symptom_id against a symptom_dictionary table
+        # instead of repeating the MedDRA term on every row
+        self.encode_symptoms = encode_symptoms
+        # Keep all_data (reports), all_vax (vaccines) and symptoms_long
+        # (symptoms) as separate fact tables and expose final_merged as a view
+        # instead of materializing the vaccine x symptom cartesian product
+        self.normalized = normalized
+        # Whether the DuckDB encodings extension could be installed; None
+        # until the first file that needs it
+        self._encodings_extension: Optional[bool] = None
+        self._encodings_lock = threading.Lock()
+        # (year, file_type, file name, error) of every CSV that failed to load
+        self.load_failures: List[tuple] = []
+
+    def find_vaers_files(self) -> Dict[int, Dict[str, Path]]:
+        """Find VAERS files grouped by year, only keeping complete sets
+
+        CSVs inside published ZIP archives (AllVAERSDataCSVS.zip or the
+        per-year zips) are returned as zipfile.Path members and read in place;
+        an extracted CSV takes precedence over the same file in an archive.
+        """
+        archive_members = []
+        self.close_archives()
+        for archive_path in sorted(self.data_folder.glob("*.zip")):
+            archive = zipfile.ZipFile(archive_path)
+            members = [
+                zipfile.Path(archive, name) for name in archive.namelist()
+                if 'VAERS' in Path(name).name and name.lower().endswith('.csv')
+            ]
+            if members:
+                self.archive_protocols[str(archive_path)] = f"vaerszip{len(self.archive_protocols)}"
+                self.archives.append(archive)
+                archive_members.extend(members)
+            else:
+                archive.close()
+        all_files = archive_members + list(self.data_folder.glob("*VAERS*.csv"))
+        
+        # Group files by year
+        years = {}
+        for file_path in all_files:
+            # Extract year from filename
+            year_match = re.search(r'(\d{4})', file_path.name)
+            if not year_match:
+                continue
+            year = int(year_match.group(1))
+            
+            if year not in years:
+                years[year] = {}
+            
+            # Categorize file type
+            if 'VAERSDATA' in file_path.name:
+                years[year]['data'] = file_path
+            elif 'VAERSVAX' in file_path.name:
+                years[year]['vax'] = file_path
+            elif 'VAERSSYMPTOMS' in file_path.name:
+                years[year]['symptoms'] = file_path
+        
+        # Only keep years with complete sets (data, vax, symptoms)
+        complete_years = {}
+        for year, files in years.items():
+            if all(key in files for key in ['data', 'vax', 'symptoms']):
+                complete_years[year] = files
+                print(f"Year {year}: Complete set found")
+                for file_type, file_path in files.items():
+                    print(f"  {file_type}: {file_path.name}")
+            else:
+                missing = [key for key in ['data', 'vax', 'symptoms'] if key not in files]
+                print(f"Year {year}: Incomplete set, missing: {missing}")
+        
+        return complete_years
+
+    def close_archives(self) -> None:
+        """Close the ZIP archives opened by find_vaers_files"""
+        for archive in self.archives:
+            archive.close()
+        self.archives = []
+        self.archive_protocols = {}
+
+    def _read_header(self, file_path: Path, encoding: str) -> List[str]:
+        """Read the column names from the first line of a VAERS CSV"""
+        with file_path.open('r', encoding=encoding, errors='replace', newline='') as f:
+            return next(csv.reader(f), [])
+
+    def _source_url(self, file_path: Path) -> str:
+        """Path DuckDB reads a VAERS CSV from, streaming archive members through fsspec"""
+        if isinstance(file_path, zipfile.Path):
+            return f"{self.archive_protocols[file_path.root.filename]}://{file_path.at}"
+        return str(file_path)
+
+    def _register_archives(self, conn: duckdb.DuckDBPyConnection, complete_years: Dict[int, Dict[str, Path]]) -> None:
+        """Make the ZIP archives referenced by complete_years readable from DuckDB"""
+        archives = {
+            file_path.root.filename
+            for files in complete_years.values()
+            for file_path in files.values()
+            if isinstance(file_path, zipfile.Path)
+        }
+        if not archives:
+            return
+
+        # Only needed for zipped releases
+        from fsspec.implementations.zip import ZipFileSystem
+
+        for archive_path in sorted(archives):
+            protocol = self.archive_protocols[archive_path]
+            # DuckDB routes paths to registered filesystems by protocol, so
+            # each archive gets a ZipFileSystem subclass with its own protocol
+            filesystem_class = type(f"VAERSZipFileSystem_{protocol}", (ZipFileSystem,), {'protocol': protocol})
+            conn.register_filesystem(filesystem_class(fo=archive_path))
+            print(f"Reading {Path(archive_path).name} in place as {protocol}://")
+
+    def _csv_types(self, file_type: str, columns: List[str]) -> Dict[str, str]:
+        """Declared column types for the columns actually present in a file"""
+        declared = VAERS_COLUMN_TYPES.get(file_type, {})
+        return {col: declared[col] for col in columns if col in declared}
+
+    def _typed_select(self, types: Dict[str, str]) -> str:
+        """SELECT list that converts the text columns read by read_csv to their declared types"""
+        conversions = []
+        for col, col_type in types.items():
+            if col_type == 'DATE':
+                conversions.append(f"CAST(TRY_STRPTIME({col}, '{VAERS_DATE_FORMAT}') AS DATE) AS {col}")
+            elif col_type != 'VARCHAR':
+                conversions.append(f"TRY_CAST({col} AS {col_type}) AS {col}")
+        return f"* REPLACE ({', '.join(conversions)})" if conversions else "*"
+
+    def _encodings_extension_available(self, conn: duckdb.DuckDBPyConnection) -> bool:
+        """Install and load the DuckDB encodings extension, once per parser"""
+        with self._encodings_lock:
+            if self._encodings_extension is None:
+                try:
+                    conn.execute("INSTALL encodings")
+                    self._encodings_extension = True
+                except Exception as e:
+                    print(f"  DuckDB encodings extension unavailable, transcoding to utf-8 instead: {str(e).splitlines()[0]}")
+                    self._encodings_extension = False
+        if self._encodings_extension:
+            conn.execute("LOAD encodings")
+        return self._encodings_extension
+
+    def _transcode_to_utf8(self, file_path: Path, encoding: str, tmp_dir: str) -> Path:
+        """Copy a CSV to a utf-8 file in tmp_dir, decoding it as encoding"""
+        utf8_path = Path(tmp_dir) / f"{Path(file_path.name).stem}.utf8.csv"
+        with file_path.open('rb') as src, open(utf8_path, 'w', encoding='utf-8', newline='') as dst:
+            # The few bytes cp1252 leaves undefined become U+FFFD
+            text = io.TextIOWrapper(src, encoding=encoding, errors='replace', newline='')
+            shutil.copyfileobj(text, dst, 8 * 1024 * 1024)
+        return utf8_path
+
+    def _read_csv_file(self, conn: duckdb.DuckDBPyConnection, table_name: str, year: int,
+                       file_type: str, file_path: Path, encoding: str) -> Dict[str, int]:
+        """Create table_name from one VAERS CSV read as encoding
+
+        Returns the number of rejected rows per DuckDB error type.
+        """
+        tmp_dir = None
+        # Rows that still cannot be parsed (e.g. a wrong number of fields)
+        # are skipped, but recorded so they can be counted
+        rejects_table = f"reject_errors_{table_name}"
+        rejects_scan = f"reject_scans_{table_name}"
+        try:
+            source_url = self._source_url(file_path)
+            read_encoding = DUCKDB_ENCODINGS[encoding]
+            if encoding not in ('utf-8', 'latin-1') and not self._encodings_extension_available(conn):
+                tmp_dir = tempfile.mkdtemp(dir=self.temp_directory)
+                source_url = str(self._transcode_to_utf8(file_path, encoding, tmp_dir))
+                read_encoding = 'utf-8'
+
+            types = self._csv_types(file_type, self._read_header(file_path, encoding))
+            # Every declared column is read as text; _typed_select converts it
+            types_sql = ', '.join(f"'{col}': 'VARCHAR'" for col in types)
+            conn.execute(f"""
+                CREATE OR REPLACE TABLE {table_name} AS 
+                SELECT {self._typed_select(types)}, '{file_path.name}' as source_file, {year} as year
+                FROM read_csv('{source_url}', header=true, types={{{types_sql}}},
+                              encoding='{read_encoding}', ignore_errors=true,
+                              store_rejects=true, rejects_table='{rejects_table}',
+                              rejects_scan='{rejects_scan}')
+            """)
+            return dict(conn.execute(f"""
+                SELECT error_type, COUNT(DISTINCT line) FROM {rejects_table} GROUP BY error_type
+            """).fetchall())
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {rejects_table}")
+            conn.execute(f"DROP TABLE IF EXISTS {rejects_scan}")
+            if tmp_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load_file(self, conn: duckdb.DuckDBPyConnection, year: int, file_type: str, file_path: Path) -> None:
+        """Load a single VAERS CSV into its {file_type}_{year} table"""
+        table_name = f"{file_type}_{year}"
+        started = self._start_stage()
+        try:
+            # Sniff the encoding once from a sample instead of retrying the
+            # whole load with one encoding after another
+            encoding = detect_encoding(file_path)
+            rejected = self._read_csv_file(conn, table_name, year, file_type, file_path, encoding)
+            if rejected.get('INVALID ENCODING') and encoding == 'utf-8':
+                # The sample missed the non-utf-8 bytes; scanning the whole
+                # file also corrects the cached encoding
+                fallback = detect_encoding(file_path, full_scan=True)
+                if fallback != encoding:
+                    print(f"  {file_path.name} is not utf-8 throughout, reloading it as {fallback}")
+                    encoding = fallback
+                    rejected = self._read_csv_file(conn, table_name, year, file_type, file_path, encoding)
+
+            count = conn.execute(f'SELECT COUNT(*) FROM {table_name}').fetchone()[0]
+            print(f"  {year} {file_type} ({encoding}): {count} records")
+            if rejected:
+                print(f"  WARNING: {sum(rejected.values())} malformed rows in {file_path.name} were skipped")
+            self._record_stage('load', started, None, count, year=year, source=file_path.name,
+                               bytes_in=source_stat(file_path)[0])
+        except Exception as e:
+            print(f"  Failed to load {file_path}: {e}")
+            self.load_failures.append((year, file_type, file_path.name, str(e)))
+
+    def _start_stage(self) -> float:
+        """Reset the peak memory counter and return the stage start time
+
+        On Linux the resident set high-water mark (VmHWM) can be reset by
+        writing 5 to /proc/self/clear_refs, so each stage reports its own
+        peak. Stages that overlap (parallel loads) share one counter.
+        """
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+        return time.perf_counter()
+
+    def _peak_memory_mb(self) -> float:
+        """Peak resident memory since the stage started, DuckDB included
+
+        Where VmHWM is not available this falls back to ru_maxrss, the peak
+        of the whole process so far.
+        """
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+    def _record_stage(self, stage: str, started: float, rows_in: Optional[int], rows_out: Optional[int],
+                      year: Optional[int] = None, source: Optional[str] = None,
+                      bytes_in: Optional[int] = None) -> None:
+        """Record the metrics of a stage whose _start_stage() returned started"""
+        wall_seconds = time.perf_counter() - started
+        self.stage_metrics.append({
+            'stage': stage,
+            'year': year,
+            'source': source,
+            'wall_seconds': round(wall_seconds, 3),
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'rows_per_second': round(rows_out / wall_seconds, 1) if rows_out and wall_seconds > 0 else None,
+            'bytes_in': bytes_in,
+            'peak_memory_mb': self._peak_memory_mb(),
+        })
+
+    def write_stage_metrics(self, output_file: str, run_started: str) -> None:
+        """Append this run's stage metrics to the output database"""
+        with duckdb.connect(output_file) as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {STAGE_METRICS_TABLE} (
+                    run_started VARCHAR,
+                    stage VARCHAR,
+                    year INTEGER,
+                    source VARCHAR,
+                    wall_seconds DOUBLE,
+                    rows_in BIGINT,
+                    rows_out BIGINT,
+                    rows_per_second DOUBLE,
+                    bytes_in BIGINT,
+                    peak_memory_mb DOUBLE
+                )
+            """)
+            conn.executemany(
+                f"INSERT INTO {STAGE_METRICS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [[run_started, m['stage'], m['year'], m['source'], m['wall_seconds'], m['rows_in'],
+                  m['rows_out'], m['rows_per_second'], m['bytes_in'], m['peak_memory_mb']]
+                 for m in self.stage_metrics],
+            )
+
+    def print_stage_metrics(self) -> None:
+        print("Stage metrics:")
+        for m in self.stage_metrics:
+            label = ' '.join(str(part) for part in (m['stage'], m['year'], m['source']) if part is not None)
+            print(f"  {label}: {m['wall_seconds']}s, rows {m['rows_in']} -> {m['rows_out']}, "
+                  f"{m['rows_per_second']} rows/s, peak {m['peak_memory_mb']} MB")
+
+    def _connect_working_database(self) -> duckdb.DuckDBPyConnection:
+        """Open the database the pipeline builds its tables in"""
+        if self.working_db:
+            # Start from an empty working database on every run
+            self._remove_working_database()
+            print(f"Building in on-disk working database {self.working_db}")
+        conn = duckdb.connect(self.working_db or ':memory:')
+
+        if self.memory_limit:
+            conn.execute(f"SET memory_limit = '{self.memory_limit}'")
+            # Keeping insertion order forces large CREATE TABLE AS and COPY
+            # statements to buffer rows instead of streaming them
+            conn.execute("SET preserve_insertion_order = false")
+        if self.temp_directory:
+            Path(self.temp_directory).mkdir(parents=True, exist_ok=True)
+            conn.execute(f"SET temp_directory = '{self.temp_directory}'")
+        return conn
+
+    def _remove_working_database(self) -> None:
+        for path in (Path(self.working_db), Path(f"{self.working_db}.wal")):
+            path.unlink(missing_ok=True)
+
+    def load_vaers_data_with_duckdb(self, complete_years: Dict[int, Dict[str, Path]]) -> duckdb.DuckDBPyConnection:
+        """Load VAERS data using DuckDB"""
+        conn = self._connect_working_database()
+        self._register_archives(conn, complete_years)
+
+        files_to_load = [
+            (year, file_type, file_path)
+            for year, files in complete_years.items()
+            for file_type, file_path in files.items()
+        ]
+
+        if not self.parallel:
+            for year, file_type, file_path in files_to_load:
+                print(f"Loading {year} {file_type} into DuckDB...")
+                self._load_file(conn, year, file_type, file_path)
+            return conn
+
+        # Each worker gets its own cursor on the shared connection so the
+        # CREATE TABLE statements run concurrently into the same database
+        workers = max(1, min(self.max_workers, len(files_to_load)))
+        print(f"Loading {len(files_to_load)} files into DuckDB with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._load_file, conn.cursor(), year, file_type, file_path)
+                for year, file_type, file_path in files_to_load
+            ]
+            # _load_file records a file that fails in load_failures itself
+            for future in as_completed(futures):
+                future.result()
+
+        return conn
+
+    def transform_symptoms_wide_to_long(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """Transform symptoms from wide format to long format using DuckDB
+
+        SYMPTOM1..SYMPTOM5 are unnested in a single scan of each symptoms
+        table. With encode_symptoms, new terms are appended to
+        symptom_dictionary and symptoms_long stores their symptom_id.
+        """
+        print("Transforming symptoms from wide to long format...")
+        
+        # Get all symptoms tables
+        tables = conn.execute("SHOW TABLES").fetchall()
+        symptoms_tables = [table[0] for table in tables if table[0].startswith('symptoms_') and table[0] != 'symptoms_long']
+        
+        if not symptoms_tables:
+            print("No symptoms tables found")
+            return
+        
+        # Create unified long symptoms table
+        conn.execute("DROP TABLE IF EXISTS symptoms_long")
+        
+        # Each year is unpivoted on its own; VAERS_IDs never span years, so
+        # grouping per table gives the same rows as grouping across all years
+        conn.execute("""
+        CREATE TEMP TABLE symptoms_unpivoted (
+            VAERS_ID BIGINT, SYMPTOM VARCHAR, symptom_count BIGINT, source_file VARCHAR, year INTEGER
+        )
+        """)
+        symptom_columns = ', '.join(f'SYMPTOM{i}' for i in range(1, 6))
+        for table_name in symptoms_tables:
+            started = self._start_stage()
+            conn.execute(f"""
+            INSERT INTO symptoms_unpivoted
+            SELECT VAERS_ID, SYMPTOM, COUNT(*) as symptom_count, source_file, year
+            FROM (
+                SELECT VAERS_ID, source_file, year, unnest([{symptom_columns}]) as SYMPTOM FROM {table_name}
+            )
+            WHERE SYMPTOM IS NOT NULL AND SYMPTOM != ''
+            GROUP BY VAERS_ID, SYMPTOM, source_file, year
+            """)
+            year = int(table_name.split('_')[1])
+            rows_in, rows_out = conn.execute(f"""
+            SELECT (SELECT COUNT(*) FROM {table_name}),
+                   (SELECT COUNT(*) FROM symptoms_unpivoted WHERE year = {year})
+            """).fetchone()
+            self._record_stage('unpivot', started, rows_in, rows_out, year=year)
+
+        if self.encode_symptoms:
+            # Existing ids are never renumbered, so symptoms_long rows from
+            # earlier runs stay valid; new terms get the next free ids
+            conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SYMPTOM_DICTIONARY_TABLE} (symptom_id INTEGER, SYMPTOM VARCHAR)
+            """)
+            conn.execute(f"""
+            INSERT INTO {SYMPTOM_DICTIONARY_TABLE}
+            SELECT (SELECT COALESCE(MAX(symptom_id), 0) FROM {SYMPTOM_DICTIONARY_TABLE})
+                       + row_number() OVER (ORDER BY SYMPTOM),
+                   SYMPTOM
+            FROM (
+                SELECT DISTINCT SYMPTOM FROM symptoms_unpivoted
+                EXCEPT
+                SELECT SYMPTOM FROM {SYMPTOM_DICTIONARY_TABLE}
+            )
+            """)
+            conn.execute(f"""
+            CREATE TABLE symptoms_long AS
+            SELECT u.VAERS_ID, d.symptom_id, u.symptom_count, u.source_file, u.year
+            FROM symptoms_unpivoted u
+            JOIN {SYMPTOM_DICTIONARY_TABLE} d ON u.SYMPTOM = d.SYMPTOM
+            """)
+        else:
+            conn.execute("CREATE TABLE symptoms_long AS SELECT * FROM symptoms_unpivoted")
+        conn.execute("DROP TABLE symptoms_unpivoted")
+        
+        count = conn.execute("SELECT COUNT(*) FROM symptoms_long").fetchone()[0]
+        symptom_key = 'symptom_id' if self.encode_symptoms else 'SYMPTOM'
+        unique_symptoms = conn.execute(f"SELECT COUNT(DISTINCT {symptom_key}) FROM symptoms_long").fetchone()[0]
+        print(f"Created {count} symptom records with {unique_symptoms} unique symptoms")
+
+    def create_final_merged_table(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """Create final merged table with all VAERS data"""
+        print("Creating final merged dataset...")
+        
+        # Get all table names
+        tables = conn.execute("SHOW TABLES").fetchall()
+        table_names = [table[0] for table in tables]
+        
+        # Find data and vax tables
+        data_tables = [t for t in table_names if t.startswith('data_')]
+        vax_tables = [t for t in table_names if t.startswith('vax_')]
+        started = self._start_stage()
+        
+        # Union all data tables
+        if data_tables:
+            data_union = ' UNION ALL '.join([f'SELECT * FROM {t}' for t in data_tables])
+            conn.execute(f"CREATE TABLE all_data AS ({data_union})")
+        
+        # Union all vax tables  
+        if vax_tables:
+            vax_union = ' UNION ALL '.join([f'SELECT * FROM {t}' for t in vax_tables])
+            conn.execute(f"CREATE TABLE all_vax AS ({vax_union})")
+        
+        vax_count = conn.execute("SELECT COUNT(*) FROM all_vax").fetchone()[0] if vax_tables else 0
+
+        if self.normalized:
+            conn.execute(f"CREATE VIEW final_merged AS {self._final_merged_query()}")
+            # The view is only evaluated by its readers, so there is no row count
+            self._record_stage('merge', started, vax_count, None)
+            print("Final merged view created over all_vax, all_data and symptoms_long")
+            return
+
+        conn.execute(f"CREATE TABLE final_merged AS {self._final_merged_query()}")
+        
+        count = conn.execute("SELECT COUNT(*) FROM final_merged").fetchone()[0]
+        self._record_stage('merge', started, vax_count, count)
+        print(f"Final merged table created with {count} records (including symptom rows)")
+
+    def _final_merged_query(self) -> str:
+        """SELECT producing final_merged from all_vax, all_data and symptoms_long"""
+        # Encoded symptoms are decoded back to their MedDRA term here
+        if self.encode_symptoms:
+            symptom_column = "sd.SYMPTOM"
+            symptom_join = f"LEFT JOIN {SYMPTOM_DICTIONARY_TABLE} sd ON s.symptom_id = sd.symptom_id"
+        else:
+            symptom_column = "s.SYMPTOM"
+            symptom_join = ""
+
+        # Symptoms as rows, not columns
+        return f"""
+        SELECT 
+            v.VAERS_ID,
+            v.VAX_TYPE, v.VAX_MANU, v.VAX_LOT, v.VAX_DOSE_SERIES, 
+            v.VAX_ROUTE, v.VAX_SITE, v.VAX_NAME, v.ORDER as VAX_ORDER,
+            d.RECVDATE, d.STATE, d.AGE_YRS, d.SEX, d.SYMPTOM_TEXT,
+            d.DIED, d.L_THREAT, d.ER_VISIT, d.HOSPITAL, d.DISABLE,
+            d.OTHER_MEDS, d.CUR_ILL, d.HISTORY,
+            {symptom_column} as SYMPTOM, s.symptom_count, v.year
+        FROM all_vax v
+        LEFT JOIN all_data d ON v.VAERS_ID = d.VAERS_ID
+        LEFT JOIN symptoms_long s ON v.VAERS_ID = s.VAERS_ID
+        {symptom_join}
+        """
+
+    def _write_processing_summary(self, conn: duckdb.DuckDBPyConnection, database: str) -> dict:
+        """Recompute processing_summary from final_merged in the given attached database"""
+        summary_stats = conn.execute(f"""
+        SELECT 
+            COUNT(*) as total_records,
+            COUNT(DISTINCT VAERS_ID) as unique_vaers_ids,
+            COUNT(DISTINCT VAX_NAME) as unique_vaccines
+        FROM {database}.final_merged
+        """).fetchone()
+
+        summary = {
+            "total_records": int(summary_stats[0]),
+            "unique_vaers_ids": int(summary_stats[1]),
+            "unique_vaccines": int(summary_stats[2]),
+            "processing_date": str(pd.Timestamp.now())
+        }
+        conn.execute(f"""
+            CREATE OR REPLACE TABLE {database}.processing_summary AS
+            SELECT $total_records::BIGINT as total_records, $unique_vaers_ids::BIGINT as unique_vaers_ids,
+                   $unique_vaccines::BIGINT as unique_vaccines, $processing_date as processing_date
+        """, summary)
+        return summary
+
+    def _copy_symptom_dictionary(self, conn: duckdb.DuckDBPyConnection, database: str) -> None:
+        """Replace the symptom dictionary in an attached database with the working one"""
+        conn.execute(f"""
+            CREATE OR REPLACE TABLE {database}.{SYMPTOM_DICTIONARY_TABLE} AS
+            SELECT * FROM {SYMPTOM_DICTIONARY_TABLE} ORDER BY symptom_id
+        """)
+        count = conn.execute(f"SELECT COUNT(*) FROM {SYMPTOM_DICTIONARY_TABLE}").fetchone()[0]
+        print(f"  Exported {SYMPTOM_DICTIONARY_TABLE}: {count} symptoms")
+
+    def output_layout(self, output_file: str) -> Dict[str, bool]:
+        """Which optional layouts an existing output database was built with"""
+        with duckdb.connect(output_file, read_only=True) as conn:
+            return {
+                'encode_symptoms': conn.execute(
+                    "SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [SYMPTOM_DICTIONARY_TABLE]
+                ).fetchone()[0] > 0,
+                'normalized': conn.execute(
+                    "SELECT COUNT(*) FROM duckdb_views() WHERE view_name = 'final_merged'"
+                ).fetchone()[0] > 0,
+            }
+
+    def load_symptom_dictionary(self, conn: duckdb.DuckDBPyConnection, output_file: str) -> None:
+        """Seed the working connection with the symptom dictionary of an existing output database"""
+        conn.execute(f"ATTACH '{output_file}' AS target (READ_ONLY)")
+        try:
+            conn.execute(f"CREATE TABLE {SYMPTOM_DICTIONARY_TABLE} AS SELECT * FROM target.{SYMPTOM_DICTIONARY_TABLE}")
+        finally:
+            conn.execute("DETACH target")
+
+    def export_to_duckdb(self, conn: duckdb.DuckDBPyConnection, output_file: str = "../intermediate_results/vaers_database.duckdb"):
+        """Export merged data to DuckDB database file
+
+        The output file is attached to the working connection and every table
+        is copied with CREATE TABLE AS, so rows go straight from DuckDB to
+        DuckDB without being materialized in Python.
+        """
+        print("Exporting data to DuckDB database...")
+        
+        conn.execute(f"ATTACH '{output_file}' AS target")
+        try:
+            conn.execute("BEGIN TRANSACTION")
+
+            # A previous build may have used the other final_merged layout, and
+            # DROP fails if the object is not of the type named
+            if conn.execute(
+                "SELECT COUNT(*) FROM duckdb_views() WHERE database_name = 'target' AND view_name = 'final_merged'"
+            ).fetchone()[0]:
+                conn.execute("DROP VIEW target.final_merged")
+            else:
+                conn.execute("DROP TABLE IF EXISTS target.final_merged")
+
+            # Copy all tables to the persistent database
+            for table in OUTPUT_TABLES:
+                if self.normalized and table == 'final_merged':
+                    continue
+                try:
+                    # Check if table exists in memory database
+                    result = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+                    if result[0] > 0:
+                        conn.execute(f"CREATE OR REPLACE TABLE target.{table} AS SELECT * FROM {table}")
+                        print(f"  Exported {table}: {result[0]} records")
+                except duckdb.CatalogException as e:
+                    print(f"  Skipped {table}: {e}")
+
+            if self.encode_symptoms:
+                self._copy_symptom_dictionary(conn, 'target')
+            else:
+                conn.execute(f"DROP TABLE IF EXISTS target.{SYMPTOM_DICTIONARY_TABLE}")
+
+            # Views bind to the tables of the database they live in
+            if self.normalized:
+                conn.execute(f"CREATE VIEW target.final_merged AS {self._final_merged_query()}")
+                print("  Exported final_merged as a view")
+
+            summary = self._write_processing_summary(conn, 'target')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DETACH target")
+        
+        print(f"Database exported to: {output_file}")
+        print(f"Summary: {summary}")
+        
+        return output_file
+
+    def export_to_parquet(self, conn: duckdb.DuckDBPyConnection,
+                          output_dir: str = "../intermediate_results/vaers_parquet",
+                          years: Optional[List[int]] = None,
+                          source_database: Optional[str] = None):
+        """Export merged data as Hive-partitioned, zstd-compressed Parquet
+
+        Each table is written to its own directory under output_dir. When years
+        is given, only those year partitions are replaced and the rest of the
+        dataset is left in place. Set source_database to export the tables of
+        an output database instead of the ones loaded in conn.
+        """
+        print(f"Exporting data to Parquet in {output_dir}...")
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        # The state is rewritten once the export has finished, so an
+        # interrupted export is redone in full on the next run
+        (output_dir / PARQUET_STATE_FILE).unlink(missing_ok=True)
+        if source_database:
+            conn.execute(f"ATTACH '{source_database}' AS parquet_source (READ_ONLY)")
+            catalog = 'parquet_source'
+        else:
+            catalog = conn.execute("SELECT current_database()").fetchone()[0]
+        try:
+            self._copy_to_parquet(conn, catalog, output_dir, years)
+        finally:
+            if source_database:
+                conn.execute("DETACH parquet_source")
+
+        return str(output_dir)
+
+    def _copy_to_parquet(self, conn: duckdb.DuckDBPyConnection, catalog: str,
+                         output_dir: Path, years: Optional[List[int]]):
+        """Write the tables (and views) of one attached database to output_dir"""
+        loaded_tables = {table[0] for table in conn.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_catalog = ?", [catalog]
+        ).fetchall()}
+
+        for table in OUTPUT_TABLES:
+            table_dir = output_dir / table
+            if years is None:
+                shutil.rmtree(table_dir, ignore_errors=True)
+            else:
+                for year in years:
+                    shutil.rmtree(table_dir / f"year={year}", ignore_errors=True)
+
+            if table not in loaded_tables:
+                continue
+            partition_by = ', '.join(PARQUET_PARTITIONS[table])
+            conn.execute(f"""
+                COPY (SELECT * FROM {catalog}.{table}) TO '{table_dir}'
+                (FORMAT parquet, PARTITION_BY ({partition_by}), COMPRESSION zstd, APPEND true)
+            """)
+            print(f"  Exported {table} partitioned by {partition_by}")
+
+        if self.encode_symptoms and SYMPTOM_DICTIONARY_TABLE in loaded_tables:
+            conn.execute(f"""
+                COPY {catalog}.{SYMPTOM_DICTIONARY_TABLE} TO '{output_dir / SYMPTOM_DICTIONARY_TABLE}.parquet'
+                (FORMAT parquet, COMPRESSION zstd)
+            """)
+            print(f"  Exported {SYMPTOM_DICTIONARY_TABLE}")
+
+    def read_parquet_state(self, parquet_dir: str) -> Dict[str, str]:
+        """Content hash of every source file the Parquet dataset was exported from"""
+        state_file = Path(parquet_dir) / PARQUET_STATE_FILE
+        if not state_file.exists():
+            return {}
+        with open(state_file) as f:
+            return json.load(f)
+
+    def write_parquet_state(self, parquet_dir: str, entries: List[tuple]) -> None:
+        """Record the source files of a finished Parquet export"""
+        with open(Path(parquet_dir) / PARQUET_STATE_FILE, 'w') as f:
+            json.dump({entry[2]: entry[5] for entry in entries}, f, indent=2, sort_keys=True)
+
+    def _file_hash(self, file_path: Path, chunk_size: int = 8 * 1024 * 1024) -> str:
+        """SHA-256 of a source file, read in chunks
+
+        Archive members already carry a CRC-32 of their content, which is used
+        instead of decompressing the member just to hash it.
+        """
+        if isinstance(file_path, zipfile.Path):
+            return f"crc32:{file_path.root.getinfo(file_path.at).CRC:08x}"
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _file_stat(self, file_path: Path):
+        """Size and mtime of a source file, as stored in the manifest"""
+        return source_stat(file_path)
+
+    def read_manifest(self, output_file: str) -> Dict[str, tuple]:
+        """Manifest rows of an existing output database, keyed by file name"""
+        if not Path(output_file).exists():
+            return {}
+        with duckdb.connect(output_file, read_only=True) as conn:
+            exists = conn.execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [MANIFEST_TABLE]
+            ).fetchone()[0]
+            if not exists:
+                return {}
+            rows = conn.execute(f"""
+                SELECT file_name, year, file_type, file_size, file_mtime, content_hash
+                FROM {MANIFEST_TABLE}
+            """).fetchall()
+        return {row[0]: row for row in rows}
+
+    def plan_incremental_load(self, complete_years: Dict[int, Dict[str, Path]], manifest: Dict[str, tuple]):
+        """Compare source files against the manifest.
+
+        Files whose size and mtime match the manifest are trusted without
+        rehashing; anything else is hashed and only counts as changed if the
+        content differs. Returns the years to reload, the years that no longer
+        have source files, and the new manifest entries.
+        """
+        to_hash = [
+            file_path
+            for files in complete_years.values()
+            for file_path in files.values()
+            if not (file_path.name in manifest
+                    and manifest[file_path.name][3:5] == self._file_stat(file_path))
+        ]
+        if self.parallel and len(to_hash) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_hash))) as executor:
+                hashes = dict(zip(to_hash, executor.map(self._file_hash, to_hash)))
+        else:
+            hashes = {file_path: self._file_hash(file_path) for file_path in to_hash}
+
+        changed_years = {}
+        entries = []
+        for year, files in sorted(complete_years.items()):
+            previous_names = {name for name, row in manifest.items() if row[1] == year}
+            year_changed = previous_names != {file_path.name for file_path in files.values()}
+            for file_type, file_path in files.items():
+                size, mtime = self._file_stat(file_path)
+                if file_path in hashes:
+                    content_hash = hashes[file_path]
+                    previous = manifest.get(file_path.name)
+                    if previous is None or previous[5] != content_hash:
+                        year_changed = True
+                else:
+                    content_hash = manifest[file_path.name][5]
+                entries.append((year, file_type, file_path.name, size, mtime, content_hash))
+            if year_changed:
+                changed_years[year] = files
+
+        removed_years = sorted({row[1] for row in manifest.values()} - set(complete_years))
+        return changed_years, removed_years, entries
+
+    def write_manifest(self, output_file: str, entries: List[tuple]) -> None:
+        """Replace the manifest in the output database with the current source files"""
+        with duckdb.connect(output_file) as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                    year INTEGER,
+                    file_type VARCHAR,
+                    file_name VARCHAR,
+                    file_size BIGINT,
+                    file_mtime DOUBLE,
+                    content_hash VARCHAR,
+                    loaded_at TIMESTAMP
+                )
+            """)
+            conn.execute(f"DELETE FROM {MANIFEST_TABLE}")
+            conn.executemany(
+                f"INSERT INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, current_timestamp)",
+                entries,
+            )
+
+    def update_database(self, conn: duckdb.DuckDBPyConnection, years: List[int],
+                        output_file: str = "../intermediate_results/vaers_database.duckdb"):
+        """Replace the rows of the given years in an existing output database"""
+        print(f"Updating {output_file} for years: {years}")
+        year_list = ', '.join(str(year) for year in years)
+        loaded_tables = {table[0] for table in conn.execute("SHOW TABLES").fetchall()}
+
+        conn.execute(f"ATTACH '{output_file}' AS target")
+        try:
+            conn.execute("BEGIN TRANSACTION")
+            for table in OUTPUT_TABLES:
+                if self.normalized and table == 'final_merged':
+                    continue
+                conn.execute(f"DELETE FROM target.{table} WHERE year IN ({year_list})")
+                if table in loaded_tables:
+                    conn.execute(f"INSERT INTO target.{table} BY NAME SELECT * FROM {table}")
+                    count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    print(f"  Replaced {table}: {count} records")
+
+            if self.encode_symptoms and SYMPTOM_DICTIONARY_TABLE in loaded_tables:
+                self._copy_symptom_dictionary(conn, 'target')
+
+            summary = self._write_processing_summary(conn, 'target')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DETACH target")
+
+        print(f"Summary: {summary}")
+        return output_file
+
+    def _output_row_count(self, conn: duckdb.DuckDBPyConnection) -> int:
+        """Rows across the output tables that exist in the working database"""
+        loaded_tables = {table[0] for table in conn.execute("SHOW TABLES").fetchall()}
+        return sum(
+            conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in OUTPUT_TABLES
+            if table in loaded_tables and not (self.normalized and table == 'final_merged')
+        )
+
+    def process_all_vaers_data(self, output_file: Optional[str] = "../intermediate_results/vaers_database.duckdb",
+                               incremental: bool = False, parquet_dir: Optional[str] = None):
+        """Complete processing pipeline using DuckDB
+
+        With incremental=True and an existing output database, only the years
+        whose source files changed since the last run are reloaded. Set
+        parquet_dir to also write the tables as partitioned Parquet, and
+        output_file=None to write only the Parquet dataset.
+        """
+        if self.working_db and output_file and Path(self.working_db).resolve() == Path(output_file).resolve():
+            raise ValueError("working_db must be a different file from output_file")
+
+        conn = None
+        self.stage_metrics = []
+        run_started = str(pd.Timestamp.now())
+        try:
+            # Find complete year sets
+            complete_years = self.find_vaers_files()
+            
+            if not complete_years:
+                raise ValueError("No complete VAERS year sets found in data folder")
+
+            # The manifest lives in the output database, so Parquet-only runs
+            # always rebuild everything
+            manifest = self.read_manifest(output_file) if incremental and output_file else {}
+            incremental = bool(manifest)
+            if incremental:
+                # Rows can only be replaced per year within the same layout
+                layout = self.output_layout(output_file)
+                expected = {'encode_symptoms': self.encode_symptoms, 'normalized': self.normalized}
+                if layout != expected:
+                    raise ValueError(
+                        f"{output_file} was built with {layout}, not {expected}; "
+                        "rerun without incremental to rebuild it"
+                    )
+            if output_file:
+                years_to_load, removed_years, manifest_entries = self.plan_incremental_load(complete_years, manifest)
+            else:
+                years_to_load, removed_years, manifest_entries = complete_years, [], []
+            changed_years = sorted(set(years_to_load) | set(removed_years))
+
+            # Only the changed years' partitions can be replaced if the Parquet
+            # dataset holds exactly what the output database held before this
+            # run; otherwise it is exported in full from the output database
+            parquet_full = bool(parquet_dir) and (not incremental or self.read_parquet_state(parquet_dir)
+                                                  != {name: row[5] for name, row in manifest.items()})
+
+            if incremental:
+                if not years_to_load and not removed_years:
+                    print("All VAERS source files unchanged since the last run")
+                    self.write_manifest(output_file, manifest_entries)
+                    if parquet_full:
+                        print(f"Parquet dataset in {parquet_dir} is out of date with {output_file}")
+                        conn = duckdb.connect()
+                        self.export_to_parquet(conn, parquet_dir, source_database=output_file)
+                        self.write_parquet_state(parquet_dir, manifest_entries)
+                    return output_file
+                print(f"Changed years: {sorted(years_to_load)}, removed years: {removed_years}")
+            
+            # Load data into DuckDB
+            self.load_failures = []
+            conn = self.load_vaers_data_with_duckdb(years_to_load)
+
+            # A year with a file that failed to load is left out entirely: its
+            # tables are dropped, the output keeps what it had for that year,
+            # and it stays out of the manifest so the next run retries it
+            failed_years = sorted({failure[0] for failure in self.load_failures})
+            if failed_years:
+                for year, file_type, file_name, error in self.load_failures:
+                    print(f"WARNING: {year} {file_type} ({file_name}) failed to load: {error}")
+                if not set(years_to_load) - set(failed_years):
+                    raise RuntimeError(f"No VAERS year could be loaded; failed years: {failed_years}")
+                print(f"Skipping years {failed_years}; they will be retried on the next run")
+                for year in failed_years:
+                    for file_type in years_to_load[year]:
+                        conn.execute(f"DROP TABLE IF EXISTS {file_type}_{year}")
+                years_to_load = {year: files for year, files in years_to_load.items() if year not in failed_years}
+                changed_years = [year for year in changed_years if year not in failed_years]
+                manifest_entries = [entry for entry in manifest_entries if entry[0] not in failed_years]
+
+            # Symptom ids must stay consistent with the rows already in the
+            # output database, so an incremental run extends its dictionary
+            if incremental and self.encode_symptoms:
+                self.load_symptom_dictionary(conn, output_file)
+
+            if years_to_load:
+                # Transform symptoms to long format
+                self.transform_symptoms_wide_to_long(conn)
+                
+                # Create final merged table
+                self.create_final_merged_table(conn)
+
+            export_rows = self._output_row_count(conn)
+            if output_file:
+                started = self._start_stage()
+                if incremental:
+                    self.update_database(conn, changed_years, output_file)
+                else:
+                    # Export to DuckDB database
+                    self.export_to_duckdb(conn, output_file)
+                self._record_stage('export', started, export_rows, export_rows, source='duckdb')
+
+            if parquet_dir:
+                started = self._start_stage()
+                if not incremental:
+                    self.export_to_parquet(conn, parquet_dir)
+                elif parquet_full:
+                    # conn only holds the changed years; the output database
+                    # has just been updated with them and holds every year
+                    print(f"Parquet dataset in {parquet_dir} is out of date with {output_file}")
+                    self.export_to_parquet(conn, parquet_dir, source_database=output_file)
+                else:
+                    self.export_to_parquet(conn, parquet_dir, changed_years)
+                self._record_stage('export', started, export_rows, export_rows, source='parquet')
+                self.write_parquet_state(parquet_dir, manifest_entries)
+
+            self.print_stage_metrics()
+
+            # Written last so a failed export is retried on the next run
+            if output_file:
+                self.write_stage_metrics(output_file, run_started)
+                self.write_manifest(output_file, manifest_entries)
+            
+            return output_file or parquet_dir
+            
+        except Exception as e:
+            print(f"Error processing VAERS data: {e}")
+            raise
+        finally:
+            if conn:
+                conn.close()
+            if self.working_db:
+                self._remove_working_database()
+            self.close_archives()
+
+
+def main():
+    try:
+        parser = VAERSParser("../vaers_data/vaers_data")
+        output_file = parser.process_all_vaers_data(incremental=True)
+        print(f"\n✓ VAERS data processing complete!")
+        print(f"Output saved to: {output_file}")
+        
+    except Exception as e:
+        print(f"✗ Error: {e}")
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
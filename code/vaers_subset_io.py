@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Read and write the VAERS subset in its array-JSON or NDJSON form.
+
+vaers_subset.json is a single pretty-printed JSON array for the frontend.
+vaers_subset.ndjson (optionally gzipped) holds one record per line, so it
+can be written while records are produced and read back one record at a
+time without loading the whole file. vaers_subset_shards/ splits the subset
+into one file per vaccine, indexed in manifest.json, so a page about one
+vaccine only downloads that vaccine's reports. vaers_subset_columnar.json
+stores the same records column by column, with repeated strings replaced
+by codes into shared dictionaries.
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+SUBSET_BASENAME = 'vaers_subset'
+
+SHARD_DIRNAME = f'{SUBSET_BASENAME}_shards'
+COLUMNAR_FILENAME = f'{SUBSET_BASENAME}_columnar.json'
+COLUMNAR_FORMAT = 'vaers_subset_columnar/1'
+
+# Fields stored as codes into a dictionary shared by all records; list fields
+# also get offsets, so record i's codes are codes[offsets[i]:offsets[i + 1]]
+DICTIONARY_FIELDS = {
+    'STATE': 'state',
+    'SEX': 'sex',
+    'RECOVD': 'recovd',
+}
+DICTIONARY_LIST_FIELDS = {
+    'VAX_TYPE_list': 'vax_type',
+    'VAX_MANU_list': 'vax_manu',
+    'VAX_NAME_list': 'vax_name',
+    'VAX_DOSE_SERIES_list': 'vax_dose_series',
+    'VAX_ROUTE_list': 'vax_route',
+    'VAX_SITE_list': 'vax_site',
+    'symptom_list': 'symptom',
+}
+MANIFEST_FILENAME = 'manifest.json'
+
+# File names in order of preference when several forms exist with the same
+# mtime; the columnar file is left out as it cannot be read record by record
+SUBSET_FILENAMES = [
+    f'{SUBSET_BASENAME}.ndjson.gz',
+    f'{SUBSET_BASENAME}.ndjson',
+    f'{SUBSET_BASENAME}.json',
+]
+
+
+def is_ndjson(path: Union[str, Path]) -> bool:
+    return str(path).endswith(('.ndjson', '.ndjson.gz'))
+
+
+def is_columnar(path: Union[str, Path]) -> bool:
+    return str(path).endswith(COLUMNAR_FILENAME)
+
+
+def _open_text(path: Union[str, Path], mode: str, compressed: bool = None):
+    if compressed is None:
+        compressed = str(path).endswith('.gz')
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode)
+
+
+def find_subset_file(json_dir: Union[str, Path] = 'json_data') -> str:
+    """Path of the most recently written subset file in json_dir
+
+    Falls back to vaers_subset.json when none exists, so callers can report
+    the missing file by its usual name.
+    """
+    candidates = [Path(json_dir) / name for name in SUBSET_FILENAMES]
+    existing = [path for path in candidates if path.exists()]
+    if not existing:
+        return str(candidates[-1])
+    # max keeps the first of equal mtimes, i.e. the preferred form
+    return str(max(existing, key=lambda path: path.stat().st_mtime))
+
+
+def iter_subset_records(path: Union[str, Path]) -> Iterator[dict]:
+    """Yield subset records from an array-JSON, (gzipped) NDJSON or columnar file
+
+    NDJSON is read line by line and array JSON element by element, so only
+    the current record is held; the columnar file has to be parsed as a whole.
+    """
+    with _open_text(path, 'r') as f:
+        if is_columnar(path):
+            yield from decode_columnar(json.load(f))
+        elif is_ndjson(path):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+
+def iter_json_array(f, chunk_chars: int = 1024 * 1024) -> Iterator:
+    """Yield the elements of a top-level JSON array read incrementally from f"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_chars)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip(chars):
+        # Skip the given characters, reading more input as needed; returns
+        # False at the end of the input
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer):
+                return True
+            if eof:
+                return False
+            fill()
+
+    if not skip(' \t\r\n') or buffer[pos] != '[':
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    while skip(' \t\r\n,'):
+        if buffer[pos] == ']':
+            return
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # A value cut off by the end of the buffer may still decode
+                # (e.g. "12" of 12.5), so it only counts once it is followed
+                # by the separator that must come after an array element
+                if (end < len(buffer) and buffer[end] in ' \t\r\n,]') or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+        pos = end
+        yield element
+    raise ValueError("Unterminated JSON array")
+
+
+def write_subset_json(records: list, path: Union[str, Path]) -> int:
+    """Write records as the pretty-printed JSON array the frontend loads"""
+    with _open_text(path, 'w') as f:
+        json.dump(records, f, indent=2)
+    return len(records)
+
+
+def write_subset_ndjson(records: Iterable[dict], path: Union[str, Path]) -> int:
+    """Stream records to an NDJSON file, gzipped if path ends in .gz
+
+    Records are written as they are consumed from the iterable and the file
+    is moved into place only once complete. Returns the number of records.
+    """
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with _open_text(tmp_path, 'w', compressed=str(path).endswith('.gz')) as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write('\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def shard_filename(vaccine_name: str) -> str:
+    """File name of a vaccine's shard, e.g. 'ZOSTER (SHINGRIX)' -> 'zoster_shingrix.json'"""
+    return re.sub(r'[^a-z0-9]+', '_', vaccine_name.lower()).strip('_') + '.json'
+
+
+def write_subset_shards(records: list, json_dir: Union[str, Path] = 'json_data') -> dict:
+    """Write one JSON array per vaccine name and index them in manifest.json
+
+    A report with several vaccines goes into the shard of each of them.
+    Shards are compact (no indentation) and replace any earlier shards. The
+    index is stored under "vaers_subset_shards" in manifest.json, keeping
+    the rest of the manifest as it is. Returns the index.
+    """
+    json_dir = Path(json_dir)
+    shard_dir = json_dir / SHARD_DIRNAME
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    shard_dir.mkdir(parents=True)
+
+    by_vaccine = defaultdict(list)
+    for record in records:
+        for vaccine_name in dict.fromkeys(record.get('VAX_NAME_list') or []):
+            by_vaccine[vaccine_name].append(record)
+
+    shards = {}
+    used_filenames = set()
+    for vaccine_name in sorted(by_vaccine):
+        filename = shard_filename(vaccine_name)
+        # Names that only differ in punctuation would share a file name
+        suffix = 2
+        while filename in used_filenames:
+            filename = f"{shard_filename(vaccine_name)[:-len('.json')]}_{suffix}.json"
+            suffix += 1
+        used_filenames.add(filename)
+
+        shard_path = shard_dir / filename
+        with open(shard_path, 'w') as f:
+            json.dump(by_vaccine[vaccine_name], f, separators=(',', ':'))
+        shards[vaccine_name] = {
+            'path': f"{SHARD_DIRNAME}/{filename}",
+            'record_count': len(by_vaccine[vaccine_name]),
+            'size_bytes': shard_path.stat().st_size,
+        }
+
+    index = {
+        'description': "vaers_subset.json split into one JSON array per VAERS vaccine name; "
+                       "reports with several vaccines appear in each of their shards",
+        'record_count': len(records),
+        'shards': shards,
+    }
+    update_manifest(json_dir, SHARD_DIRNAME, index)
+    return index
+
+
+def update_manifest(json_dir: Union[str, Path], key: str, entry: dict) -> None:
+    """Set one top-level entry of json_data/manifest.json"""
+    manifest_path = Path(json_dir) / MANIFEST_FILENAME
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    manifest[key] = entry
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def encode_columnar(records: list) -> dict:
+    """Turn subset records into the struct-of-arrays form of vaers_subset_columnar.json"""
+    fields = list(records[0]) if records else []
+    dictionaries = {name: [] for name in list(DICTIONARY_FIELDS.values()) + list(DICTIONARY_LIST_FIELDS.values())}
+    codes_by_value = {name: {} for name in dictionaries}
+
+    def code(dictionary, value):
+        codes = codes_by_value[dictionary]
+        if value not in codes:
+            codes[value] = len(dictionaries[dictionary])
+            dictionaries[dictionary].append(value)
+        return codes[value]
+
+    columns = {}
+    for field in fields:
+        if field in DICTIONARY_LIST_FIELDS:
+            dictionary = DICTIONARY_LIST_FIELDS[field]
+            offsets = [0]
+            codes = []
+            for record in records:
+                codes.extend(code(dictionary, value) for value in record[field])
+                offsets.append(len(codes))
+            columns[field] = {'dictionary': dictionary, 'offsets': offsets, 'codes': codes}
+        elif field in DICTIONARY_FIELDS:
+            dictionary = DICTIONARY_FIELDS[field]
+            columns[field] = {
+                'dictionary': dictionary,
+                'codes': [None if record[field] is None else code(dictionary, record[field]) for record in records],
+            }
+        else:
+            columns[field] = {'values': [record[field] for record in records]}
+
+    return {
+        'format': COLUMNAR_FORMAT,
+        'record_count': len(records),
+        'fields': fields,
+        'dictionaries': dictionaries,
+        'columns': columns,
+    }
+
+
+def decode_columnar(data: dict) -> Iterator[dict]:
+    """Yield the records of a decoded vaers_subset_columnar.json document"""
+    dictionaries = data['dictionaries']
+    columns = data['columns']
+    for i in range(data['record_count']):
+        record = {}
+        for field in data['fields']:
+            column = columns[field]
+            if 'offsets' in column:
+                dictionary = dictionaries[column['dictionary']]
+                codes = column['codes'][column['offsets'][i]:column['offsets'][i + 1]]
+                record[field] = [dictionary[c] for c in codes]
+            elif 'dictionary' in column:
+                c = column['codes'][i]
+                record[field] = None if c is None else dictionaries[column['dictionary']][c]
+            else:
+                record[field] = column['values'][i]
+        yield record
+
+
+def write_subset_columnar(records: list, path: Union[str, Path]) -> int:
+    """Write records in the compact columnar, dictionary-encoded format"""
+    with _open_text(path, 'w') as f:
+        json.dump(encode_columnar(records), f, separators=(',', ':'))
+    return len(records)
@@ -3,6 +3,8 @@ import pandas as pd
 import os
 from fuzzywuzzy import fuzz, process
 
+from csv_encoding import detect_encoding
+
 def get_unique_vax_combinations(file_path):
     """
     Get all unique combinations of VAX_TYPE, VAX_MANU, VAX_NAME from a VAERS CSV file.
@@ -13,18 +15,25 @@ def get_unique_vax_combinations(file_path):
     Returns:
         DataFrame: Unique combinations of VAX_TYPE, VAX_MANU, VAX_NAME or None if error.
     """
-    encodings = ['utf-8', 'latin1', 'ISO-8859-1', 'cp1252']
-    for encoding in encodings:
+    try:
+        encoding = detect_encoding(file_path)
+        print(f"Reading VAERS data with {encoding} encoding...")
         try:
-            print(f"Trying to read VAERS data with {encoding} encoding...")
             df = pd.read_csv(file_path, encoding=encoding, on_bad_lines='skip',
                              usecols=['VAX_TYPE', 'VAX_MANU', 'VAX_NAME'], low_memory=False)
-            unique_combinations = df[['VAX_TYPE', 'VAX_MANU', 'VAX_NAME']].drop_duplicates().reset_index(drop=True)
-            print(f"Successfully read VAERS data with {encoding} encoding.")
-            return unique_combinations
-        except Exception as e:
+        except UnicodeDecodeError as e:
+            # The sampled encoding was wrong further into the file
             print(f"Error reading VAERS data with {encoding} encoding: {str(e)}")
-    print("Could not read the VAERS data file with any of the attempted encodings.")
+            encoding = detect_encoding(file_path, full_scan=True)
+            print(f"Reading VAERS data with {encoding} encoding...")
+            df = pd.read_csv(file_path, encoding=encoding, on_bad_lines='skip',
+                             usecols=['VAX_TYPE', 'VAX_MANU', 'VAX_NAME'], low_memory=False)
+        unique_combinations = df[['VAX_TYPE', 'VAX_MANU', 'VAX_NAME']].drop_duplicates().reset_index(drop=True)
+        print(f"Successfully read VAERS data with {encoding} encoding.")
+        return unique_combinations
+    except Exception as e:
+        print(f"Error reading VAERS data: {str(e)}")
+    print("Could not read the VAERS data file.")
     return None
 
 def add_fda_matching_file(input_csv_path, fda_dir_path, output_csv_path, cutoff_score=40):
@@ -5,6 +5,7 @@ Verify that VAERS subset vaccines match FDA reports by vaccine name and manufact
 
 import json
 from collections import defaultdict
+from vaers_subset_io import find_subset_file, iter_subset_records
 
 def verify_vaccine_matching():
     """Check if VAERS subset vaccines match FDA reports"""
@@ -16,8 +17,8 @@ def verify_vaccine_matching():
     
     # Load VAERS subset
     print("Loading VAERS subset...")
-    with open('json_data/vaers_subset.json', 'r') as f:
-        vaers_subset = json.load(f)
+    vaers_subset = iter_subset_records(find_subset_file('json_data'))
+    record_count = 0
     
     # Build FDA vaccine lookup
     fda_vaccines = {}
@@ -50,6 +51,7 @@ def verify_vaccine_matching():
     unmatched_vaccines = set()
     
     for record in vaers_subset:
+        record_count += 1
         # Check each vaccine in the record
         vax_names = record.get('VAX_NAME_list', [])
         vax_manus = record.get('VAX_MANU_list', [])
@@ -73,7 +75,7 @@ def verify_vaccine_matching():
                     vaers_vaccine_manu_pairs[(vax_name, vax_manu)] += 1
     
     print(f"\nVAERS Subset Summary:")
-    print(f"  Total records: {len(vaers_subset)}")
+    print(f"  Total records: {record_count}")
     print(f"  Unique vaccines found: {len(vaers_vaccine_counts)}")
     print(f"  Unique manufacturers found: {len(vaers_manufacturer_counts)}")
     